@@ -1,26 +1,79 @@
+import grp
 import os
 import os.path
+import pwd
+import select
 import signal
+import socket
 import shutil
+import ssl
+import stat
+import threading
 import time
 import tests.network as network
 import psycopg2
 import subprocess
 import datetime as dt
 from collections import namedtuple
+from functools import lru_cache
 from nose.tools import eq_
 from enum import Enum
 import json
+import struct
 
 import tests.ssl_cert_utils as cert
 
 COMMAND_TIMEOUT = network.COMMAND_TIMEOUT
-POLLING_INTERVAL = 0.1
+POLLING_INTERVAL = 0.05
+POLLING_INTERVAL_MAX = 1
+POLLING_FAST_PERIOD = 2
 STATE_CHANGE_TIMEOUT = 90
+
+
+def sudo_as(user):
+    """
+    Returns the command prefix that runs a command as the given user, with
+    the PATH of the test process.
+    """
+    return [
+        shutil.which("sudo") or "sudo",
+        "-E",
+        "-u",
+        user,
+        "env",
+        "PATH=" + os.getenv("PATH"),
+    ]
+
+
+# run a command as the test user
+SUDO_AS_USER = sudo_as(os.getenv("USER"))
+
 PGVERSION = os.getenv("PGVERSION", "11")
 
+# the test Postgres instances are thrown away, skip disk flushes when asked
+# to; only settings that don't change which code paths run belong here, e.g.
+# full_page_writes=off would have pg_rewind refuse the source server
+UNSAFE_DURABILITY = os.getenv("PG_AUTOCTL_TEST_UNSAFE") == "1"
+UNSAFE_DURABILITY_SETTINGS = {
+    "fsync": "off",
+}
+
 NodeState = namedtuple("NodeState", "reported assigned")
 
+# states in which pg_autoctl leaves the Postgres configuration alone
+STABLE_STATES = ("single", "primary", "secondary")
+NodeSettings = namedtuple(
+    "NodeSettings",
+    "candidate_priority replication_quorum number_sync_standbys",
+)
+
+# Postgres protocol SSLRequest code, see src/include/libpq/pqcomm.h
+SSL_REQUEST_CODE = 80877103
+PROTOCOL_VERSION_3 = 196608
+
+# SQLSTATE cannot_connect_now, sent while Postgres starts up or shuts down
+ERRCODE_CANNOT_CONNECT_NOW = "57P03"
+
 
 # Append stderr output to default CalledProcessError message
 class CalledProcessError(subprocess.CalledProcessError):
@@ -63,6 +116,10 @@ class Cluster:
         self.monitor = None
         self.datanodes = []
 
+        # nodes may be created from several threads at once, and reading the
+        # output of a pg_autoctl process is not thread safe
+        self.output_lock = threading.Lock()
+
     def create_monitor(
         self,
         datadir,
@@ -148,6 +205,20 @@ class Cluster:
         self.datanodes.append(datanode)
         return datanode
 
+    def launch_datanode(self, datadir, target_state=None, **kwargs):
+        """
+        Creates a data node with create_datanode(), then runs "pg_autoctl
+        create" and "pg_autoctl run" for it. When target_state is given, also
+        waits until the node reaches that state. Returns the DataNode.
+        """
+        datanode = self.create_datanode(datadir, **kwargs)
+        datanode.create_and_run()
+
+        if target_state is not None:
+            assert datanode.wait_until_state(target_state=target_state)
+
+        return datanode
+
     def pg_createcluster(self, datadir, port=5432):
         """
         Initializes a postgresql node using pg_createcluster and returns
@@ -217,8 +288,15 @@ class Cluster:
         """
         flush the output for all running pg_autoctl processes in the cluster
         """
-        for node in self.nodes():
-            node.flush_output()
+        # when another thread is already flushing the output, we're done
+        if not self.output_lock.acquire(blocking=False):
+            return
+
+        try:
+            for node in self.nodes():
+                node.flush_output()
+        finally:
+            self.output_lock.release()
 
     def sleep(self, secs):
         """
@@ -234,6 +312,21 @@ class Cluster:
         self.flush_output()
         time.sleep(secs - full_secs)
 
+    def wait_until(self, predicate, timeout=10, interval=0.2):
+        """
+        Calls predicate() every interval seconds until it returns a true
+        value, and then returns True. If this doesn't happen until "timeout"
+        seconds, returns False. The output of the cluster is flushed while
+        waiting.
+        """
+        wait_until = dt.datetime.now() + dt.timedelta(seconds=timeout)
+        while wait_until > dt.datetime.now():
+            if predicate():
+                return True
+            self.sleep(interval)
+
+        return bool(predicate())
+
     def communicate(self, proc, timeout):
         """
         communicate with the process with the specified timeout while flushing
@@ -253,22 +346,206 @@ class Cluster:
         self.flush_output()
         return proc.communicate(timeout=timeout - full_secs)
 
+    def wait_until_states(
+        self,
+        node_states,
+        timeout=STATE_CHANGE_TIMEOUT,
+        sleep_time=POLLING_INTERVAL,
+    ):
+        """
+        Waits until every node in the node_states dictionary reaches its
+        target state, and then returns True. All the nodes are checked in
+        the same polling loop, so that waiting for N nodes costs a single
+        timeout rather than N of them. Raises an Exception when some nodes
+        still have not reached their target state after "timeout" seconds.
+        """
+        pending = dict(node_states)
+        prev_states = {}
+        intervals = polling_intervals(sleep_time)
+        wait_until = dt.datetime.now() + dt.timedelta(seconds=timeout)
+
+        while wait_until > dt.datetime.now():
+            for node, target_state in list(pending.items()):
+                current_state, assigned_state = node.get_state()
+                node.disable_durability_when_stable(
+                    current_state, assigned_state
+                )
+
+                # only log the state if it has changed
+                if current_state != prev_states.get(node):
+                    if current_state == target_state:
+                        print(
+                            "state of %s is '%s', done waiting"
+                            % (node.logger_name(), current_state)
+                        )
+                    else:
+                        print(
+                            "state of %s is '%s', waiting for '%s' ..."
+                            % (node.logger_name(), current_state, target_state)
+                        )
+
+                if current_state == target_state:
+                    del pending[node]
+
+                prev_states[node] = current_state
+
+            if not pending:
+                return True
+
+            if self.monitor:
+                self.monitor.wait_for_state_change(next(intervals))
+            else:
+                self.sleep(next(intervals))
+
+        error_msg = "".join(
+            f"{node.logger_name()} failed to reach {target_state} "
+            f"after {timeout} seconds\n"
+            for node, target_state in pending.items()
+        )
+        print(error_msg)
+
+        # print_debug_logs() already covers every node of the cluster
+        next(iter(pending)).print_debug_logs()
+        raise Exception(error_msg)
+
+    def set_candidate_priorities(
+        self, node_priorities, timeout=STATE_CHANGE_TIMEOUT
+    ):
+        """
+        Sets the candidate priority of every node in the node_priorities
+        dictionary in a single transaction on the monitor, rather than with
+        one pg_autoctl command per node. Then, as pg_autoctl does, waits
+        until the primary has applied the new settings.
+        """
+        query = "; ".join(
+            [
+                "select pgautofailover.set_node_candidate_priority("
+                "formationid, nodename, %s) "
+                "from pgautofailover.node where nodeid = %s"
+            ]
+            * len(node_priorities)
+        )
+        args = []
+        for node, candidatePriority in node_priorities.items():
+            args += [candidatePriority, node.nodeid]
+
+        self.monitor.run_sql_query(query, *args)
+
+        q = (
+            "select count(*) from pgautofailover.node "
+            "where 'apply_settings' in (reportedstate, goalstate)"
+        )
+        intervals = polling_intervals()
+        wait_until = dt.datetime.now() + dt.timedelta(seconds=timeout)
+
+        while wait_until > dt.datetime.now():
+            if self.monitor.run_sql_query(q)[0][0] == 0:
+                return True
+
+            self.monitor.wait_for_state_change(next(intervals))
+
+        raise Exception(
+            f"new candidate priorities not applied after {timeout} seconds"
+        )
+
+    def all_have_needed_replication_slots(self, nodes, verbose=True):
+        """
+        Checks has_needed_replication_slots() for all the given nodes, using
+        a single query on the monitor to fetch the expected slots list of
+        every node at once.
+        """
+        expected = self.monitor.get_expected_replication_slots(
+            [node.nodeid for node in nodes]
+        )
+        missing = [
+            node
+            for node in nodes
+            if not node.has_needed_replication_slots(
+                verbose=False, expected_slots=expected.get(node.nodeid, [])
+            )
+        ]
+
+        if not missing:
+            return True
+
+        if verbose:
+            # print_debug_logs() already covers every node of the cluster
+            missing[0].print_debug_logs()
+            print()
+            for node in missing:
+                print(
+                    "slots list on %s is %s, expected %s"
+                    % (
+                        node.datadir,
+                        sorted(node.list_replication_slot_names()),
+                        expected.get(node.nodeid, []),
+                    )
+                )
+        return False
+
     def create_root_cert(self, directory, basename="root", CN="root"):
         self.cert = cert.SSLCert(directory, basename, CN)
         self.cert.create_root_cert()
 
 
 class QueryRunner:
+    # connection to this node, shared by all the run_sql_query() calls
+    conn = None
+    conn_dsn = None
+
     def connection_string(self):
         raise NotImplementedError
 
+    def connection(self):
+        """
+        Returns the cached connection to this postgres node, and opens a new
+        one when needed, including when the connection string has changed or
+        when Postgres has been restarted since the connection was opened.
+        """
+        dsn = self.connection_string()
+
+        if (
+            self.conn is None
+            or self.conn.closed
+            or self.conn_dsn != dsn
+            or self.connection_is_broken()
+        ):
+            self.close_connection()
+            self.conn = psycopg2.connect(dsn, keepalives=1)
+            self.conn_dsn = dsn
+
+        return self.conn
+
+    def connection_is_broken(self):
+        """
+        Returns True when the server has sent data or closed the socket of our
+        idle cached connection, which only happens when the backend has been
+        terminated, for instance when pg_autoctl restarts Postgres. psycopg2
+        would only notice at the next query, after having sent it.
+        """
+        readable, _, _ = select.select([self.conn], [], [], 0)
+        return len(readable) > 0
+
+    def close_connection(self):
+        """
+        Closes the cached connection to this postgres node, if any. This is
+        needed when the node is stopped or disconnected.
+        """
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            self.conn_dsn = None
+
     def run_sql_query(self, query, autocommit, *args):
         """
         Runs the given sql query with the given arguments in this postgres node
         and returns the results. Returns None if there are no results to fetch.
         """
         result = None
-        conn = psycopg2.connect(self.connection_string())
+
+        # the query is not retried on errors: a connection that broke while
+        # running it may have run it already, and some tests expect the error
+        conn = self.connection()
         conn.autocommit = autocommit
 
         with conn:
@@ -278,25 +555,24 @@ class QueryRunner:
                     result = cur.fetchall()
                 except psycopg2.ProgrammingError:
                     pass
-        # leaving contexts closes the cursor, however
-        # leaving contexts doesn't close the connection
-        conn.close()
+        # leaving contexts closes the cursor and ends the transaction,
+        # however leaving contexts doesn't close the connection
 
         return result
 
     def alter_system_set(self, gucs):
         """
         Calls ALTER SYSTEM SET on the provided GUCs, then pg_reload_conf().
+        ALTER SYSTEM can't run in a transaction block, so we use autocommit.
+
+        The values are sent as query parameters, so they must be raw Python
+        values such as 1000 or "1s", not SQL literals that are already quoted.
         """
-        psql_command = [shutil.which("psql"), "-d", self.database, "-c"]
         for key in gucs:
-            sql = "alter system set %s = %s" % (key, gucs[key])
-            command = psql_command + [sql]
-            self.vnode.run_and_wait(command, name="alter system set")
+            sql = "alter system set %s = %%s" % key
+            QueryRunner.run_sql_query(self, sql, True, gucs[key])
 
-        sql = "select pg_reload_conf()"
-        command = psql_command + [sql]
-        self.vnode.run_and_wait(command, name="alter system set")
+        QueryRunner.run_sql_query(self, "select pg_reload_conf()", True)
 
 
 class PGNode(QueryRunner):
@@ -338,9 +614,6 @@ class PGNode(QueryRunner):
         self.sslServerKey = sslServerKey
         self.sslServerCert = sslServerCert
 
-        self._pgversion = None
-        self._pgmajor = None
-
     def connection_string(self):
         """
         Returns a connection string which can be used to connect to this postgres
@@ -418,7 +691,7 @@ class PGNode(QueryRunner):
         Returns the current value of the given postgres settings"
         """
         if isinstance(settings, str):
-            return self.run_sql_query(f"SHOW {setting}")[0][0]
+            return self.run_sql_query(f"SHOW {settings}")[0][0]
 
         else:
             # we have a list of settings to grab
@@ -459,6 +732,8 @@ class PGNode(QueryRunner):
         Stops the postgres process by running:
           pg_ctl -D ${self.datadir} --wait --mode fast stop
         """
+        self.close_connection()
+
         # pg_ctl stop is racey when another process is trying to start postgres
         # again in the background. It will not finish in that case. pg_autoctl
         # does this, so we try stopping postgres a couple of times. This way we
@@ -522,12 +797,29 @@ class PGNode(QueryRunner):
         """
         Restart Postgres with pg_autoctl do service restart postgres
         """
+        self.close_connection()
         command = PGAutoCtl(self)
 
         command.execute(
             "service restart postgres", "do", "service", "restart", "postgres"
         )
 
+    def disable_durability(self):
+        """
+        Turns fsync off on the local Postgres instance when
+        PG_AUTOCTL_TEST_UNSAFE=1 is set in the environment. synchronous_commit
+        is left alone, as pg_autoctl manages it for synchronous replication.
+        """
+        if not UNSAFE_DURABILITY:
+            return
+
+        with open(os.path.join(self.datadir, "postgresql.conf"), "a") as conf:
+            for setting, value in UNSAFE_DURABILITY_SETTINGS.items():
+                conf.write("%s = %s\n" % (setting, value))
+
+        if os.path.exists(os.path.join(self.datadir, "postmaster.pid")):
+            self.run_sql_query("select pg_reload_conf()")
+
     def pg_is_running(self, timeout=COMMAND_TIMEOUT):
         """
         Returns true when Postgres is running. We use pg_ctl status.
@@ -541,22 +833,123 @@ class PGNode(QueryRunner):
             return False
         return True
 
+    def tls_handshake(self, cafile):
+        """
+        Opens a TLS session with Postgres, as "openssl s_client -starttls
+        postgres" does, and verifies the server certificate with the given
+        root certificate. Returns the server certificate, and raises an
+        exception when Postgres doesn't accept SSL or the handshake fails.
+        """
+        context = ssl.create_default_context(cafile=cafile)
+
+        # the certificates name the nodes, we connect to their IP address
+        context.check_hostname = False
+
+        address = (str(self.vnode.address), self.port)
+
+        with socket.create_connection(address, timeout=COMMAND_TIMEOUT) as sock:
+            sock.sendall(struct.pack("!ii", 8, SSL_REQUEST_CODE))
+
+            if sock.recv(1) != b"S":
+                raise Exception("Postgres at %s:%d refused SSL" % address)
+
+            with context.wrap_socket(sock) as tls:
+                return tls.getpeercert()
+
+    def pg_ping(self):
+        """
+        Returns True when Postgres accepts connections, as pg_isready does:
+        we send a startup packet and any answer but a cannot_connect_now
+        error means the server is up, including authentication requests and
+        errors. This doesn't need to authenticate nor to fork a process.
+        """
+        address = (str(self.vnode.address), self.port)
+        params = b"user\0pg_ping\0database\0pg_ping\0\0"
+
+        with socket.create_connection(address, timeout=1) as sock:
+            sock.sendall(
+                struct.pack("!ii", 8 + len(params), PROTOCOL_VERSION_3) + params
+            )
+            reply = sock.makefile("rb")
+            message = reply.read(1)
+
+            if message != b"E":
+                # AuthenticationRequest, or the connection has been closed
+                return message == b"R"
+
+            header = reply.read(4)
+
+            if len(header) < 4:
+                return False
+
+            (length,) = struct.unpack("!i", header)
+            fields = reply.read(length - 4).split(b"\0")
+
+        # ErrorResponse fields are a type byte followed by a string
+        sqlstate = [f[1:].decode() for f in fields if f[:1] == b"C"]
+        return sqlstate != [ERRCODE_CANNOT_CONNECT_NOW]
+
     def wait_until_pg_is_running(self, timeout=STATE_CHANGE_TIMEOUT):
         """
-        Waits until the underlying Postgres process is running.
+        Waits until the underlying Postgres process is accepting connections,
+        probing the server in-process with pg_ping() rather than forking a
+        pg_isready process for each attempt.
         """
-        command = PGAutoCtl(self)
-        out, err, ret = command.execute(
-            "pgsetup ready", "do", "pgsetup", "wait", "-vvv"
-        )
+        intervals = polling_intervals()
+        wait_until = dt.datetime.now() + dt.timedelta(seconds=timeout)
 
-        return ret == 0
+        while wait_until > dt.datetime.now():
+            try:
+                if self.pg_ping():
+                    return True
+
+            except OSError:
+                pass
+
+            self.cluster.sleep(next(intervals))
+
+        return False
+
+    def wait_until_wal_received(self, lsn, timeout=STATE_CHANGE_TIMEOUT):
+        """
+        Waits until this standby node has received the WAL up to the given
+        LSN. The polling loop runs server-side in a single DO block, so that
+        we don't pay for a client round-trip per check. Raises an exception
+        when the LSN has not been received after "timeout" seconds.
+        """
+        self.run_sql_query(
+            """
+        DO $$
+        DECLARE
+            deadline timestamptz := clock_timestamp()
+                                    + make_interval(secs => %s);
+        BEGIN
+            WHILE pg_last_wal_receive_lsn() IS NULL
+               OR pg_last_wal_receive_lsn() < %s::pg_lsn
+            LOOP
+                IF clock_timestamp() > deadline
+                THEN
+                    RAISE EXCEPTION 'WAL not received up to %% after %%s',
+                                    %s, %s;
+                END IF;
+
+                PERFORM pg_sleep(0.05);
+            END LOOP;
+        END
+        $$
+        """,
+            timeout,
+            lsn,
+            lsn,
+            timeout,
+        )
 
     def fail(self):
         """
         Simulates a data node failure by terminating the keeper and stopping
         postgres.
         """
+        self.close_connection()
         self.stop_pg_autoctl()
 
         # stopping pg_autoctl also stops Postgres, unless bugs.
@@ -620,9 +1013,10 @@ class PGNode(QueryRunner):
 
     def pgversion(self):
         """
-        Query local Postgres for its version. Cache the result.
+        Query local Postgres for its version. Cache the result, the server
+        version of a node doesn't change during a test run.
         """
-        if self._pgversion:
+        if self._pgversion is not None:
             return self._pgversion
 
         # server_version_num is 110005 for 11.5
@@ -634,16 +1028,19 @@ class PGNode(QueryRunner):
         return self._pgversion
 
     def pgmajor(self):
-        if self._pgmajor:
-            return self._pgmajor
+        """
+        Returns the Postgres major version of the node, see pgversion().
+        """
+        if self._pgmajor is None:
+            self.pgversion()
 
-        self.pgversion()
         return self._pgmajor
 
     def ifdown(self):
         """
         Bring the network interface down for this node
         """
+        self.close_connection()
         self.vnode.ifdown()
 
     def ifup(self):
@@ -917,15 +1314,40 @@ class PGNode(QueryRunner):
 
 
 class StatefulNode:
+    # set by create() for nodes created with --run
+    durability_pending = False
+
     def logger_name(self):
         raise NotImplementedError
 
     def sleep(self, sleep_time):
         raise NotImplementedError
 
+    def wait_for_state_change(self, timeout):
+        """
+        Waits for at most timeout seconds, returning early when some state
+        change might have happened.
+        """
+        self.sleep(timeout)
+
     def print_debug_logs(self):
         raise NotImplementedError
 
+    def disable_durability_when_stable(self, current_state, assigned_state):
+        """
+        Nodes created with --run are still being initialized by pg_autoctl,
+        which rewrites their configuration and restarts Postgres, when
+        create() returns. Their durability is disabled once they first reach
+        a stable state instead.
+        """
+        if (
+            self.durability_pending
+            and current_state == assigned_state
+            and current_state in STABLE_STATES
+        ):
+            self.durability_pending = False
+            self.disable_durability()
+
     def wait_until_state(
         self,
         target_state,
@@ -937,11 +1359,11 @@ class StatefulNode:
         True. If this doesn't happen until "timeout" seconds, returns False.
         """
         prev_state = None
+        intervals = polling_intervals(sleep_time)
         wait_until = dt.datetime.now() + dt.timedelta(seconds=timeout)
         while wait_until > dt.datetime.now():
-            self.sleep(sleep_time)
-
             current_state, assigned_state = self.get_state()
+            self.disable_durability_when_stable(current_state, assigned_state)
 
             # only log the state if it has changed
             if current_state != prev_state:
@@ -960,6 +1382,7 @@ class StatefulNode:
                 return True
 
             prev_state = current_state
+            self.wait_for_state_change(next(intervals))
 
         print(
             "%s didn't reach %s after %d seconds"
@@ -984,12 +1407,12 @@ class StatefulNode:
         monitor FSM.
         """
         prev_state = None
+        intervals = polling_intervals(sleep_time)
         wait_until = dt.datetime.now() + dt.timedelta(seconds=timeout)
 
         while wait_until > dt.datetime.now():
-            self.cluster.sleep(sleep_time)
-
             current_state, assigned_state = self.get_state()
+            self.disable_durability_when_stable(current_state, assigned_state)
 
             # only log the state if it has changed
             if assigned_state != prev_state:
@@ -1008,6 +1431,7 @@ class StatefulNode:
                 return True
 
             prev_state = assigned_state
+            self.wait_for_state_change(next(intervals))
 
         print(
             "%s didn't reach %s after %d seconds"
@@ -1200,8 +1624,10 @@ class DataNode(PGNode, StatefulNode):
         self.pg_autoctl = PGAutoCtl(self, create_args)
         if run:
             self.pg_autoctl.run()
+            self.durability_pending = True
         else:
             self.pg_autoctl.execute("pg_autoctl create")
+            self.disable_durability()
 
         # sometimes we might have holes in the nodeid sequence
         # grab the current nodeid, if it's already available
@@ -1209,6 +1635,14 @@ class DataNode(PGNode, StatefulNode):
         if nodeid > 0:
             self.nodeid = nodeid
 
+    def create_and_run(self, **kwargs):
+        """
+        Runs "pg_autoctl create" with the given arguments, and then starts
+        "pg_autoctl run" for this node.
+        """
+        self.create(**kwargs)
+        self.run()
+
     def logger_name(self):
         return self.datadir
 
@@ -1238,7 +1672,8 @@ class DataNode(PGNode, StatefulNode):
 
     def get_local_state(self):
         """
-        Fetch the assigned_state from the pg_autoctl state file.
+        Returns the current and assigned state of the node as found in the
+        pg_autoctl state file, using pg_autoctl do fsm state.
         """
         command = PGAutoCtl(self)
         out, err, ret = command.execute(
@@ -1246,7 +1681,7 @@ class DataNode(PGNode, StatefulNode):
         )
 
         self.state = json.loads(out)
-        return (
+        return NodeState(
             self.state["state"]["current_role"],
             self.state["state"]["assigned_role"],
         )
@@ -1283,6 +1718,7 @@ class DataNode(PGNode, StatefulNode):
         """
         Cleans up processes and files created for this data node.
         """
+        self.close_connection()
 
         self.stop_pg_autoctl()
 
@@ -1325,6 +1761,12 @@ class DataNode(PGNode, StatefulNode):
     def sleep(self, sleep_time):
         self.cluster.sleep(sleep_time)
 
+    def wait_for_state_change(self, timeout):
+        if self.monitor:
+            self.monitor.wait_for_state_change(timeout)
+        else:
+            self.sleep(timeout)
+
     def get_events(self):
         """
         Returns the current list of events from the monitor.
@@ -1364,6 +1806,31 @@ class DataNode(PGNode, StatefulNode):
         command = PGAutoCtl(self)
         command.execute("disable maintenance", "disable", "maintenance")
 
+    def enable_maintenance_and_wait(
+        self,
+        target_state="maintenance",
+        allowFailover=False,
+        timeout=STATE_CHANGE_TIMEOUT,
+    ):
+        """
+        Enables maintenance on a pg_autoctl node and returns once the node
+        has reached the target state. The pg_autoctl command already waits
+        for the monitor to notify that the node reached maintenance, so the
+        following wait usually only needs a single state query.
+        """
+        self.enable_maintenance(allowFailover=allowFailover)
+        return self.wait_until_state(target_state, timeout=timeout)
+
+    def disable_maintenance_and_wait(
+        self, target_state="secondary", timeout=STATE_CHANGE_TIMEOUT
+    ):
+        """
+        Disables maintenance on a pg_autoctl node and returns once the node
+        has reached the target state.
+        """
+        self.disable_maintenance()
+        return self.wait_until_state(target_state, timeout=timeout)
+
     def perform_promotion(self):
         """
         Calls pg_autoctl perform promotion on a Postgres node
@@ -1406,6 +1873,7 @@ class DataNode(PGNode, StatefulNode):
 
         :return:
         """
+        self.close_connection()
         command = PGAutoCtl(self)
         command.execute("drop node", "drop", "node")
         return True
@@ -1565,6 +2033,26 @@ class DataNode(PGNode, StatefulNode):
 
         return int(out)
 
+    def get_node_settings(self):
+        """
+        Gets candidate priority, replication quorum, and the formation number
+        sync standbys in a single query on the monitor, rather than running
+        one pg_autoctl get command for each of them.
+        """
+        query = (
+            "select candidatepriority, replicationquorum, "
+            "number_sync_standbys "
+            "from pgautofailover.node "
+            "join pgautofailover.formation using(formationid) "
+            "where nodeid = %s"
+        )
+        result = self.monitor.run_sql_query(query, self.nodeid)
+
+        if len(result) == 0:
+            raise Exception("node %s not found on the monitor" % self.nodeid)
+
+        return NodeSettings(*result[0])
+
     def get_synchronous_standby_names(self):
         """
         Gets synchronous standby names  via pg_autoctl
@@ -1617,7 +2105,7 @@ class DataNode(PGNode, StatefulNode):
             self.print_debug_logs()
             raise e
 
-    def has_needed_replication_slots(self):
+    def has_needed_replication_slots(self, verbose=True, expected_slots=None):
         """
         Each node is expected to maintain a slot for each of the other nodes
         the primary through streaming replication, the secondary(s) manually
@@ -1626,19 +2114,23 @@ class DataNode(PGNode, StatefulNode):
         Postgres 10 lacks the function pg_replication_slot_advance() so when
         the local Postgres is version 10 we don't create any replication
         slot on the standby servers.
+
+        When verbose is False, a mismatch is not logged, which allows polling
+        for the slots to be maintained without stopping pg_autoctl to print
+        its logs. When expected_slots is given, the monitor is not queried.
         """
         if self.pgmajor() == 10:
             return True
 
-        hostname = str(self.vnode.address)
-        other_nodes = self.monitor.get_other_nodes(self.nodeid)
-        expected_slots = [
-            "pgautofailover_standby_%s" % n[0] for n in other_nodes
-        ]
+        if expected_slots is None:
+            other_nodes = self.monitor.get_other_nodes(self.nodeid)
+            expected_slots = [
+                "pgautofailover_standby_%s" % n[0] for n in other_nodes
+            ]
         current_slots = self.list_replication_slot_names()
 
         # just to make it easier to read through the print()ed list
-        expected_slots.sort()
+        expected_slots = sorted(expected_slots)
         current_slots.sort()
 
         if set(expected_slots) == set(current_slots):
@@ -1646,6 +2138,9 @@ class DataNode(PGNode, StatefulNode):
             #       (self.datadir, current_slots))
             return True
 
+        if not verbose:
+            return False
+
         self.print_debug_logs()
         print()
         print(
@@ -1679,7 +2174,54 @@ class DataNode(PGNode, StatefulNode):
         )
 
 
-class MonitorNode(PGNode):
+class StateListener:
+    """
+    Waits for the monitor state change notifications. Used by the classes
+    that connect to a monitor, which provide connection_string() and sleep().
+    """
+
+    # connection that LISTENs to the monitor state change notifications
+    listen_conn = None
+
+    def listen_state_changes(self):
+        """
+        Returns a connection to the monitor that LISTENs to the "state"
+        channel, where the monitor notifies every node state change.
+        """
+        if self.listen_conn is None or self.listen_conn.closed:
+            conn = psycopg2.connect(self.connection_string(), keepalives=1)
+            conn.autocommit = True
+
+            with conn.cursor() as cur:
+                cur.execute("LISTEN state")
+
+            self.listen_conn = conn
+
+        return self.listen_conn
+
+    def unlisten_state_changes(self):
+        if self.listen_conn is not None:
+            self.listen_conn.close()
+            self.listen_conn = None
+
+    def wait_for_state_change(self, timeout):
+        """
+        Waits until the monitor notifies a state change, for at most timeout
+        seconds. When the monitor can't be reached, just sleep instead.
+        """
+        try:
+            conn = self.listen_state_changes()
+
+            if conn.notifies or select.select([conn], [], [], timeout)[0]:
+                conn.poll()
+                conn.notifies.clear()
+
+        except psycopg2.Error:
+            self.unlisten_state_changes()
+            self.sleep(timeout)
+
+
+class MonitorNode(PGNode, StateListener):
     def __init__(
         self,
         cluster,
@@ -1716,6 +2258,14 @@ class MonitorNode(PGNode):
         else:
             self.hostname = str(self.vnode.address)
 
+    def close_connection(self):
+        super().close_connection()
+        self.unlisten_state_changes()
+
+    def wait_for_state_change(self, timeout):
+        self.cluster.flush_output()
+        super().wait_for_state_change(timeout)
+
     def create(self, level="-v", run=False):
         """
         Initializes and runs the monitor process.
@@ -1761,9 +2311,12 @@ class MonitorNode(PGNode):
 
         self.pg_autoctl = PGAutoCtl(self, create_args)
         if run:
+            # the monitor has no stable state to wait for, and no test
+            # creates it with --run, so its durability is left alone then
             self.pg_autoctl.run()
         else:
             self.pg_autoctl.execute("create monitor")
+            self.disable_durability()
 
     def run(self, env={}, name=None, host=None, port=None):
         """
@@ -1783,6 +2336,8 @@ class MonitorNode(PGNode):
         """
         Cleans up processes and files created for this monitor node.
         """
+        self.close_connection()
+
         if self.pg_autoctl:
             out, err, ret = self.pg_autoctl.stop()
 
@@ -1826,7 +2381,7 @@ class MonitorNode(PGNode):
         :return: None
         """
         formation_command = [
-            shutil.which("pg_autoctl"),
+            pg_autoctl_program(),
             "create",
             "formation",
             "--pgdata",
@@ -1888,18 +2443,11 @@ class MonitorNode(PGNode):
         """
         performs manual failover for given formation and group id
         """
-        failover_command_text = (
-            "select * from pgautofailover.perform_failover('%s', %s)"
-            % (formation, group)
+        self.run_sql_query(
+            "select * from pgautofailover.perform_failover(%s, %s)",
+            formation,
+            group,
         )
-        failover_command = [
-            shutil.which("psql"),
-            "-d",
-            self.database,
-            "-c",
-            failover_command_text,
-        ]
-        self.vnode.run_and_wait(failover_command, name="manual failover")
 
     def print_state(self, formation="default"):
         print("pg_autoctl show state --pgdata %s" % self.datadir)
@@ -1917,6 +2465,23 @@ class MonitorNode(PGNode):
         query = "select * from pgautofailover.get_other_nodes(%s)"
         return self.run_sql_query(query, nodeid)
 
+    def get_expected_replication_slots(self, nodeids):
+        """
+        Returns a dictionary of the replication slot names that each of the
+        given nodes is expected to maintain, one for each of the nodes that
+        get_other_nodes() returns, calling it for all the nodes at once.
+        """
+        query = (
+            "select n.nodeid, "
+            "array_agg('pgautofailover_standby_' || o.node_id "
+            "order by o.node_id) "
+            "from unnest(%s::bigint[]) as n(nodeid) "
+            "cross join lateral pgautofailover.get_other_nodes(n.nodeid) o "
+            "group by n.nodeid"
+        )
+        result = self.run_sql_query(query, list(nodeids))
+        return {nodeid: slots for nodeid, slots in result}
+
     def check_ssl(self, ssl, sslmode):
         """
         Checks if ssl settings match how the node is set up
@@ -1960,22 +2525,7 @@ class PGAutoCtl:
         self.pgnode = pgnode
 
         self.command = None
-        self.program = shutil.which("pg_autoctl")
-
-        if self.program is None:
-            pg_config = shutil.which("pg_config")
-
-            if pg_config is None:
-                raise Exception(
-                    "Failed to find pg_config in %s" % os.environ["PATH"]
-                )
-            else:
-                # run pg_config --bindir
-                p = subprocess.run(
-                    [pg_config, "--bindir"], text=True, capture_output=True
-                )
-                bindir = p.stdout.splitlines()[0]
-                self.program = os.path.join(bindir, "pg_autoctl")
+        self.program = pg_autoctl_program()
 
         self.run_proc = None
         self.last_returncode = None
@@ -2129,21 +2679,107 @@ class PGAutoCtl:
             print("pg_autoctl process for %s is not running" % self.datadir)
 
 
+def polling_intervals(first=POLLING_INTERVAL, maximum=POLLING_INTERVAL_MAX):
+    """
+    Yields the successive sleep times of a polling loop. Most state changes
+    happen quickly, so we poll every "first" seconds for POLLING_FAST_PERIOD
+    seconds, and then back off exponentially up to "maximum" seconds.
+    """
+    elapsed = 0
+    interval = first
+
+    while True:
+        yield interval
+
+        elapsed += interval
+        if elapsed >= POLLING_FAST_PERIOD:
+            interval = min(interval * 2, max(maximum, first))
+
+
+@lru_cache(maxsize=None)
+def pg_autoctl_program():
+    """
+    Returns the path to the pg_autoctl binary. The lookup might need to run
+    pg_config --bindir, so it is done only once per test process.
+    """
+    program = shutil.which("pg_autoctl")
+
+    if program is None:
+        pg_config = shutil.which("pg_config")
+
+        if pg_config is None:
+            raise Exception(
+                "Failed to find pg_config in %s" % os.environ["PATH"]
+            )
+        else:
+            # run pg_config --bindir
+            p = subprocess.run(
+                [pg_config, "--bindir"], text=True, capture_output=True
+            )
+            bindir = p.stdout.splitlines()[0]
+            program = os.path.join(bindir, "pg_autoctl")
+
+    return program
+
+
 def sudo_mkdir_p(directory):
     """
-    Runs the command: sudo mkdir -p directory
+    Creates the directory and its missing parents for the test user, as the
+    command "sudo -u $USER mkdir -p directory" would, without a subprocess.
     """
-    p = subprocess.Popen(
-        [
-            "sudo",
-            "-E",
-            "-u",
-            os.getenv("USER"),
-            "env",
-            "PATH=" + os.getenv("PATH"),
-            "mkdir",
-            "-p",
-            directory,
-        ]
+    cert.mkdir_p(directory)
+
+
+def run_as_user(*command, user=None):
+    """
+    Runs the given command as the test user, or as the given user, and raises
+    an exception when it fails.
+    """
+    prefix = SUDO_AS_USER if user is None else sudo_as(user)
+
+    subprocess.run(
+        prefix + list(command),
+        check=True,
+        timeout=COMMAND_TIMEOUT,
+    )
+
+
+def print_file_modes(*paths):
+    """
+    Prints the mode, owner, and group of the given paths, as ls -ld does,
+    without running a subprocess.
+    """
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            print("%s: no such file or directory" % path)
+            continue
+
+        try:
+            owner = pwd.getpwuid(st.st_uid).pw_name
+        except KeyError:
+            owner = st.st_uid
+
+        try:
+            group = grp.getgrgid(st.st_gid).gr_name
+        except KeyError:
+            group = st.st_gid
+
+        print("%s %s %s %s" % (stat.filemode(st.st_mode), owner, group, path))
+
+
+def ssn_for(number_sync_standbys, standby_ids):
+    """
+    Returns the synchronous_standby_names setting that the monitor computes
+    for the given number_sync_standbys and list of standby node ids. The ids
+    must be given in the same order as the monitor uses: by decreasing
+    candidate priority, then by node id.
+    """
+    if not standby_ids:
+        return ""
+
+    return "ANY %d (%s)" % (
+        number_sync_standbys,
+        ", ".join("pgautofailover_standby_%d" % i for i in standby_ids),
     )
-    assert p.wait(timeout=COMMAND_TIMEOUT) == 0
@@ -2,7 +2,48 @@
 # SSL Certificate creation in the test environment
 #
 import subprocess
-import os, os.path, time, shutil
+import os, os.path, pwd, stat, shutil, hashlib, secrets, time
+
+from concurrent.futures import ThreadPoolExecutor
+
+# generated certificates are kept here and reused by the next test modules
+CACHE_DIRECTORY = os.getenv("PG_AUTOCTL_TEST_CERT_CACHE", "/tmp/ssl-cert-cache")
+CACHE_EXTENSIONS = ("key", "csr", "crt")
+
+# cached certificates are regenerated well before they expire: signed
+# certificates are valid for 365 days and the root certificate for 10 years
+CACHE_MAX_AGE = 30 * 24 * 3600
+
+# ECDSA P-256 keys are much cheaper to generate than RSA keys, and the tests
+# only need a valid certificate chain
+KEY_OPTIONS = ["-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1"]
+
+
+def mkdir_p(directory):
+    """
+    Creates the directory and its missing parents, owned by the test user
+    that runs openssl and Postgres, as "sudo -u $USER mkdir -p" would.
+    """
+    missing = []
+    path = os.path.abspath(directory)
+
+    while not os.path.isdir(path):
+        missing.append(path)
+        path = os.path.dirname(path)
+
+    for path in reversed(missing):
+        os.mkdir(path)
+        chown_to_user(path)
+
+
+def chown_to_user(*paths):
+    """
+    Gives the given files to the test user that runs Postgres.
+    """
+    user = pwd.getpwnam(os.getenv("USER"))
+
+    for path in paths:
+        os.chown(path, user.pw_uid, user.pw_gid)
 
 
 class SSLCert:
@@ -23,26 +64,85 @@ class SSLCert:
         self.rootCert = None
         self.crl = None
 
-        self.sudo_mkdir_p()
+        mkdir_p(self.directory)
 
-    def sudo_mkdir_p(self):
-        if os.path.isdir(self.directory):
-            return True
+    def run_command(self, args, outputs=()):
+        """
+        Runs the given command and then gives the files it created to the
+        test user. The tests run as root, so we don't need to go through
+        sudo to have the files owned by the test user.
+        """
+        program = shutil.which(args[0])
+        subprocess.run([program] + args[1:], check=True)
+        chown_to_user(*outputs)
 
-        p = subprocess.Popen(
-            [
-                "sudo",
-                "-E",
-                "-u",
-                os.getenv("USER"),
-                "env",
-                "PATH=" + os.getenv("PATH"),
-                "mkdir",
-                "-p",
-                self.directory,
-            ]
-        )
-        assert p.wait() == 0
+    def cache_key(self, rootSSLCert=None):
+        """
+        Returns the cache key of this certificate: a hash of its subject, of
+        its key options and, for a signed certificate, of the root certificate
+        that signs it.
+        """
+        digest = hashlib.sha256(self.CN.encode())
+        digest.update(" ".join(KEY_OPTIONS).encode())
+
+        if rootSSLCert is not None:
+            with open(rootSSLCert.crt, "rb") as crt:
+                digest.update(crt.read())
+
+        return digest.hexdigest()
+
+    def restore_from_cache(self, cacheKey, extensions=CACHE_EXTENSIONS):
+        """
+        Copies the given files (key, CSR, and certificate by default) from the
+        cache when they are found there and are recent enough, and returns
+        True. Otherwise returns False.
+        """
+        if not CACHE_DIRECTORY:
+            return False
+
+        cached = [
+            os.path.join(CACHE_DIRECTORY, "%s.%s" % (cacheKey, ext))
+            for ext in extensions
+        ]
+
+        if not all(os.path.exists(path) for path in cached):
+            return False
+
+        if any(
+            time.time() - os.path.getmtime(path) > CACHE_MAX_AGE
+            for path in cached
+        ):
+            return False
+
+        for path, ext in zip(cached, extensions):
+            target = os.path.join(
+                self.directory, "%s.%s" % (self.basename, ext)
+            )
+            shutil.copyfile(path, target)
+            chown_to_user(target)
+            setattr(self, ext, target)
+
+        os.chmod(self.key, stat.S_IRUSR | stat.S_IWUSR)
+        return True
+
+    def store_in_cache(self, cacheKey):
+        """
+        Copies the key, CSR, and certificate we just created to the cache.
+        The root certificate authority has no CSR.
+        """
+        if not CACHE_DIRECTORY:
+            return
+
+        os.makedirs(CACHE_DIRECTORY, mode=0o700, exist_ok=True)
+
+        for ext in CACHE_EXTENSIONS:
+            if getattr(self, ext) is None:
+                continue
+
+            shutil.copyfile(
+                getattr(self, ext),
+                os.path.join(CACHE_DIRECTORY, "%s.%s" % (cacheKey, ext)),
+            )
 
     def create_root_cert(self):
         # avoid bugs where we overwrite certificates in a given directory
@@ -50,145 +150,146 @@ class SSLCert:
         assert self.crt is None
         assert self.key is None
 
-        self.csr = os.path.join(self.directory, "%s.csr" % self.basename)
+        if self.restore_from_cache(self.cache_key(), ("key", "crt")):
+            return
+
         self.key = os.path.join(self.directory, "%s.key" % self.basename)
         self.crt = os.path.join(self.directory, "%s.crt" % self.basename)
 
-        # first create a certificate signing request (CSR) and a public/private
-        # key file
+        # create a public/private key file and the self-signed root
+        # certificate authority in a single step, without an intermediate
+        # certificate signing request (CSR)
         print()
-        p = subprocess.Popen(
+        self.run_command(
             [
-                "sudo",
-                "-E",
-                "-u",
-                os.getenv("USER"),
-                "env",
-                "PATH=" + os.getenv("PATH"),
                 "openssl",
                 "req",
+                "-x509",
                 "-new",
                 "-nodes",
-                "-text",
-                "-out",
-                self.csr,
-                "-keyout",
-                self.key,
-                "-subj",
-                self.CN,
             ]
-        )
-        assert p.wait() == 0
-
-        p = subprocess.Popen(["chmod", "og-rwx", self.key])
-        assert p.wait() == 0
-
-        # Then, sign the request with the key to create a root certificate
-        # authority
-        p = subprocess.Popen(
-            [
-                "sudo",
-                "-E",
-                "-u",
-                os.getenv("USER"),
-                "env",
-                "PATH=" + os.getenv("PATH"),
-                "openssl",
-                "x509",
-                "-req",
-                "-in",
-                self.csr,
-                "-text",
+            + KEY_OPTIONS
+            + [
                 "-days",
                 "3650",
-                "-extfile",
+                "-config",
                 "/etc/ssl/openssl.cnf",
                 "-extensions",
                 "v3_ca",
-                "-signkey",
-                self.key,
                 "-out",
                 self.crt,
-            ]
+                "-keyout",
+                self.key,
+                "-subj",
+                self.CN,
+            ],
+            outputs=[self.crt, self.key],
         )
-        assert p.wait() == 0
+
+        os.chmod(self.key, stat.S_IRUSR | stat.S_IWUSR)
+
+        self.store_in_cache(self.cache_key())
 
     def create_signed_certificate(self, rootSSLCert):
+        if self.restore_signed_certificate(rootSSLCert):
+            return
+
+        self.create_key_and_csr()
+        self.sign_certificate(rootSSLCert)
+
+    def restore_signed_certificate(self, rootSSLCert):
+        """
+        Restores this certificate from the cache when it has already been
+        signed by the same root certificate, and returns True.
+        """
         # avoid bugs where we overwrite certificates in a given directory
         assert self.csr is None
         assert self.crt is None
         assert self.key is None
 
+        if not self.restore_from_cache(self.cache_key(rootSSLCert)):
+            return False
+
         self.rootKey = rootSSLCert.key
         self.rootCert = rootSSLCert.crt
         self.crl = rootSSLCert.crl
 
-        self.crt = os.path.join(self.directory, "%s.crt" % self.basename)
+        return True
+
+    def create_key_and_csr(self):
+        """
+        Creates a private key and a certificate signing request (CSR). This
+        step doesn't need the root certificate authority, so it can run
+        concurrently for several certificates.
+        """
+        # avoid bugs where we overwrite certificates in a given directory
+        assert self.csr is None
+        assert self.crt is None
+        assert self.key is None
+
         self.csr = os.path.join(self.directory, "%s.csr" % self.basename)
         self.key = os.path.join(self.directory, "%s.key" % self.basename)
 
-        p = subprocess.Popen(
+        self.run_command(
             [
-                "sudo",
-                "-E",
-                "-u",
-                os.getenv("USER"),
-                "env",
-                "PATH=" + os.getenv("PATH"),
                 "openssl",
                 "req",
                 "-new",
                 "-nodes",
-                "-text",
+            ]
+            + KEY_OPTIONS
+            + [
                 "-out",
                 self.csr,
                 "-keyout",
                 self.key,
                 "-subj",
                 self.CN,
-            ]
+            ],
+            outputs=[self.csr, self.key],
         )
-        assert p.wait() == 0
 
-        p = subprocess.Popen(["chmod", "og-rwx", self.key])
-        assert p.wait() == 0
+        os.chmod(self.key, stat.S_IRUSR | stat.S_IWUSR)
+
+    def sign_certificate(self, rootSSLCert):
+        """
+        Signs our CSR with the root certificate authority. We pick a random
+        serial number rather than sharing the root serial file, so that
+        several certificates can be signed concurrently.
+        """
+        assert self.csr is not None
+        assert self.crt is None
 
-        p = subprocess.Popen(
+        self.rootKey = rootSSLCert.key
+        self.rootCert = rootSSLCert.crt
+        self.crl = rootSSLCert.crl
+
+        self.crt = os.path.join(self.directory, "%s.crt" % self.basename)
+
+        self.run_command(
             [
-                "sudo",
-                "-E",
-                "-u",
-                os.getenv("USER"),
-                "env",
-                "PATH=" + os.getenv("PATH"),
                 "openssl",
                 "x509",
                 "-req",
                 "-in",
                 self.csr,
-                "-text",
                 "-days",
                 "365",
                 "-CA",
                 self.rootCert,
                 "-CAkey",
                 self.rootKey,
-                "-CAcreateserial",
+                "-set_serial",
+                "0x%x" % secrets.randbits(64),
                 "-out",
                 self.crt,
-            ]
+            ],
+            outputs=[self.crt],
         )
-        assert p.wait() == 0
 
         print("openssl verify -CAfile %s %s" % (self.rootCert, self.crt))
-        p = subprocess.Popen(
+        self.run_command(
             [
-                "sudo",
-                "-E",
-                "-u",
-                os.getenv("USER"),
-                "env",
-                "PATH=" + os.getenv("PATH"),
                 "openssl",
                 "verify",
                 "-show_chain",
@@ -197,4 +298,36 @@ class SSLCert:
                 self.crt,
             ]
         )
-        assert p.wait() == 0
+
+        self.store_in_cache(self.cache_key(rootSSLCert))
+
+
+def create_signed_certificates(sslCerts, rootSSLCert):
+    """
+    Creates the given certificates concurrently, each one signed with the
+    root certificate authority. Certificates found in the cache are restored
+    from there instead.
+    """
+    sslCerts = [
+        sslCert
+        for sslCert in sslCerts
+        if not sslCert.restore_signed_certificate(rootSSLCert)
+    ]
+
+    if not sslCerts:
+        return
+
+    with ThreadPoolExecutor(max_workers=len(sslCerts)) as executor:
+        for future in [
+            executor.submit(create_and_sign_certificate, sslCert, rootSSLCert)
+            for sslCert in sslCerts
+        ]:
+            future.result()
+
+
+def create_and_sign_certificate(sslCert, rootSSLCert):
+    """
+    Runs the whole openssl pipeline for a single certificate.
+    """
+    sslCert.create_key_and_csr()
+    sslCert.sign_certificate(rootSSLCert)
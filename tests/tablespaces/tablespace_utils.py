@@ -1,6 +1,7 @@
 import time
 from tests.pgautofailover_utils import QueryRunner
 from tests.pgautofailover_utils import StatefulNode
+from tests.pgautofailover_utils import StateListener
 
 
 class PGNodeTS(QueryRunner):
@@ -16,7 +17,7 @@ class PGNodeTS(QueryRunner):
         )
 
 
-class MonitorNodeTS(PGNodeTS):
+class MonitorNodeTS(PGNodeTS, StateListener):
     def __init__(self, port, service_name):
         self.port = port
         self.service_name = service_name
@@ -24,6 +25,9 @@ class MonitorNodeTS(PGNodeTS):
         self.username = "autoctl_node"
         self.database = "pg_auto_failover"
 
+    def sleep(self, sleep_time):
+        time.sleep(sleep_time)
+
 
 class DataNodeTS(PGNodeTS, StatefulNode):
     def __init__(self, port, service_name, monitor_node):
@@ -39,6 +43,9 @@ class DataNodeTS(PGNodeTS, StatefulNode):
     def sleep(self, sleep_time):
         time.sleep(sleep_time)
 
+    def wait_for_state_change(self, timeout):
+        self.monitor.wait_for_state_change(timeout)
+
     def print_debug_logs(self):
         # no-op, can't get logs easily in this test-type
         return
@@ -11,13 +11,16 @@ def test_000_init_monitor_and_primary():
 
 
 def test_002_create_t1():
-    node1.run_sql_query("CREATE TABLE t1(a int)")
-    node1.run_sql_query("INSERT INTO t1 VALUES (1), (2)")
+    node1.run_sql_query(
+        "CREATE TABLE t1(a int); INSERT INTO t1 VALUES (1), (2);"
+    )
 
 
 def test_003_create_tablespace():
     node1.run_sql_query(
         "CREATE TABLESPACE extended_a LOCATION '/extra_volumes/extended_a';"
     )
-    node1.run_sql_query("CREATE TABLE t2(i int) TABLESPACE extended_a;")
-    node1.run_sql_query("INSERT INTO t2 VALUES (3), (4);")
+    node1.run_sql_query(
+        "CREATE TABLE t2(i int) TABLESPACE extended_a;"
+        "INSERT INTO t2 VALUES (3), (4);"
+    )
@@ -20,8 +20,10 @@ def test_003_create_tablespace_while_streaming():
     node1.run_sql_query(
         "CREATE TABLESPACE extended_b LOCATION '/extra_volumes/extended_b';"
     )
-    node1.run_sql_query("CREATE TABLE t3(i int) TABLESPACE extended_b;")
-    node1.run_sql_query("INSERT INTO t3 VALUES (5), (6)")
+    node1.run_sql_query(
+        "CREATE TABLE t3(i int) TABLESPACE extended_b;"
+        "INSERT INTO t3 VALUES (5), (6);"
+    )
 
 
 def test_004_read_from_secondary_again():
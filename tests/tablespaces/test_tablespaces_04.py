@@ -9,7 +9,9 @@ def test_001_old_primary_goes_down():
     node2.run_sql_query(
         "CREATE TABLESPACE extended_c LOCATION '/extra_volumes/extended_c';"
     )
-    node2.run_sql_query("CREATE TABLE t4(i int) TABLESPACE extended_c;")
-    node2.run_sql_query("INSERT INTO t4 VALUES (10), (11)")
-    node2.run_sql_query("INSERT INTO t2 VALUES (12)")
-    node2.run_sql_query("INSERT INTO t3 VALUES (13)")
+    node2.run_sql_query(
+        "CREATE TABLE t4(i int) TABLESPACE extended_c;"
+        "INSERT INTO t4 VALUES (10), (11);"
+        "INSERT INTO t2 VALUES (12);"
+        "INSERT INTO t3 VALUES (13);"
+    )
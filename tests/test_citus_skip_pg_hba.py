@@ -2,7 +2,7 @@ import tests.pgautofailover_utils as pgautofailover
 from nose.tools import raises, eq_
 
 import subprocess
-import os, os.path, time, shutil
+import os, os.path, shutil
 import pprint
 
 cluster = None
@@ -122,18 +122,14 @@ def test_002e_check_hba():
 
 
 def test_002f_activated_node():
-    timeout = 10
     q = "select isactive from pg_dist_node where nodename = %s"
-    isactive = coord0a.run_sql_query(q, str(worker1a.vnode.address))[0][0]
 
-    while timeout > 0 and isactive is not True:
-        print(".", end="")
-        time.sleep(1)
-        timeout -= 1
-
-        isactive = coord0a.run_sql_query(q, str(worker1a.vnode.address))[0][0]
+    def is_active():
+        return (
+            coord0a.run_sql_query(q, str(worker1a.vnode.address))[0][0] is True
+        )
 
-    if isactive is not True:
+    if not cluster.wait_until(is_active, timeout=10):
         raise Exception(
             "test failed: worker1a is still not activated "
             + "in the coordinator after 10s"
@@ -2,7 +2,7 @@ import tests.pgautofailover_utils as pgautofailover
 from nose.tools import *
 
 import os
-import subprocess
+import shutil
 
 cluster = None
 node1 = None
@@ -44,22 +44,9 @@ def test_003_init_secondary():
     # fail the registration of a node2 by using a PGDATA directory that has
     # already been created, with another system_identifier (initdb creates a
     # new one each time)
-    p = subprocess.Popen(
-        [
-            "sudo",
-            "-E",
-            "-u",
-            os.getenv("USER"),
-            "env",
-            "PATH=" + os.getenv("PATH"),
-            "pg_ctl",
-            "initdb",
-            "-s",
-            "-D",
-            "/tmp/sb-from-pgdata/node2",
-        ]
+    pgautofailover.run_as_user(
+        "pg_ctl", "initdb", "-s", "-D", "/tmp/sb-from-pgdata/node2"
     )
-    assert p.wait() == 0
 
     node2 = cluster.create_datanode("/tmp/sb-from-pgdata/node2")
 
@@ -77,20 +64,10 @@ def test_004_create_raises_error():
 def test_005_cleanup_after_failure():
     print("Failed as expected, cleaning up")
     print("rm -rf /tmp/sb-from-pgdata/node2")
-    p = subprocess.Popen(
-        [
-            "sudo",
-            "-E",
-            "-u",
-            os.getenv("USER"),
-            "env",
-            "PATH=" + os.getenv("PATH"),
-            "rm",
-            "-rf",
-            "/tmp/sb-from-pgdata/node2",
-        ]
-    )
-    assert p.wait() == 0
+    if os.path.exists("/tmp/sb-from-pgdata/node2"):
+        shutil.rmtree("/tmp/sb-from-pgdata/node2")
+
+    assert not os.path.exists("/tmp/sb-from-pgdata/node2")
 
 
 def test_006_init_secondary():
@@ -99,21 +76,9 @@ def test_006_init_secondary():
     # create node3 from a manual copy of node1 to test creating a standby
     # from an existing PGDATA (typically PGDATA would be deployed from a
     # backup and recovery mechanism)
-    p = subprocess.Popen(
-        [
-            "sudo",
-            "-E",
-            "-u",
-            os.getenv("USER"),
-            "env",
-            "PATH=" + os.getenv("PATH"),
-            "cp",
-            "-a",
-            "/tmp/sb-from-pgdata/node1",
-            "/tmp/sb-from-pgdata/node3",
-        ]
+    pgautofailover.run_as_user(
+        "cp", "-a", "/tmp/sb-from-pgdata/node1", "/tmp/sb-from-pgdata/node3"
     )
-    assert p.wait() == 0
 
     os.remove("/tmp/sb-from-pgdata/node3/postmaster.pid")
 
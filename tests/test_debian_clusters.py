@@ -1,6 +1,6 @@
 import tests.pgautofailover_utils as pgautofailover
 import os.path
-import subprocess
+import stat
 
 cluster = None
 monitor = None
@@ -35,22 +35,15 @@ def test_000_create_monitor():
 
     pgversion = os.getenv("PGVERSION")
 
-    p = subprocess.run(
-        [
-            "ls",
-            "-ld",
-            monitor_path,
-            "/var/lib/postgresql/%s" % pgversion,
-            "/etc/postgresql/%s" % pgversion,
-            "/etc/postgresql/%s/monitor" % pgversion,
-            "/etc/postgresql/%s/monitor/postgresql.conf" % pgversion,
-            "/etc/postgresql/%s/monitor/pg_hba.conf" % pgversion,
-            "/etc/postgresql/%s/monitor/pg_ident.conf" % pgversion,
-        ],
-        text=True,
-        capture_output=True,
+    pgautofailover.print_file_modes(
+        monitor_path,
+        "/var/lib/postgresql/%s" % pgversion,
+        "/etc/postgresql/%s" % pgversion,
+        "/etc/postgresql/%s/monitor" % pgversion,
+        "/etc/postgresql/%s/monitor/postgresql.conf" % pgversion,
+        "/etc/postgresql/%s/monitor/pg_hba.conf" % pgversion,
+        "/etc/postgresql/%s/monitor/pg_ident.conf" % pgversion,
     )
-    print("%s" % p.stdout)
 
 
 def test_001_custom_single():
@@ -71,22 +64,15 @@ def test_001_custom_single():
 
     pgversion = os.getenv("PGVERSION")
 
-    p = subprocess.run(
-        [
-            "ls",
-            "-ld",
-            node1_path,
-            "/var/lib/postgresql/%s" % pgversion,
-            "/etc/postgresql/%s" % pgversion,
-            "/etc/postgresql/%s/debian_node1" % pgversion,
-            "/etc/postgresql/%s/debian_node1/postgresql.conf" % pgversion,
-            "/etc/postgresql/%s/debian_node1/pg_hba.conf" % pgversion,
-            "/etc/postgresql/%s/debian_node1/pg_ident.conf" % pgversion,
-        ],
-        text=True,
-        capture_output=True,
+    pgautofailover.print_file_modes(
+        node1_path,
+        "/var/lib/postgresql/%s" % pgversion,
+        "/etc/postgresql/%s" % pgversion,
+        "/etc/postgresql/%s/debian_node1" % pgversion,
+        "/etc/postgresql/%s/debian_node1/postgresql.conf" % pgversion,
+        "/etc/postgresql/%s/debian_node1/pg_hba.conf" % pgversion,
+        "/etc/postgresql/%s/debian_node1/pg_ident.conf" % pgversion,
     )
-    print("%s" % p.stdout)
 
     monitor.print_state()
 
@@ -101,7 +87,5 @@ def test_002_chmod_debian_data_directory():
     # we need to give the postgres group the w on the top-level directory
     pgversion = os.getenv("PGVERSION")
 
-    p = subprocess.Popen(
-        ["chmod", "go+w", "/var/lib/postgresql/%s" % pgversion]
-    )
-    assert p.wait() == 0
+    path = "/var/lib/postgresql/%s" % pgversion
+    os.chmod(path, os.stat(path).st_mode | stat.S_IWGRP | stat.S_IWOTH)
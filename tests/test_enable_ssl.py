@@ -1,9 +1,14 @@
 import tests.pgautofailover_utils as pgautofailover
 import tests.ssl_cert_utils as cert
-import subprocess
 import os
+import shutil
 import time
 
+# libpq reads the client certificates from ~/.postgresql, and the tests
+# connect as root too
+CLIENT_TOP_DIRECTORY = os.path.join(os.getenv("HOME"), ".postgresql")
+ROOT_TOP_DIRECTORY = "/root/.postgresql"
+
 cluster = None
 monitor = None
 node1 = None
@@ -19,38 +24,10 @@ def teardown_module():
     cluster.destroy()
 
     # remove client side setup for certificates too
-    client_top_directory = os.path.join(os.getenv("HOME"), ".postgresql")
-
-    p = subprocess.Popen(
-        [
-            "sudo",
-            "-E",
-            "-u",
-            os.getenv("USER"),
-            "env",
-            "PATH=" + os.getenv("PATH"),
-            "rm",
-            "-rf",
-            client_top_directory,
-        ]
-    )
-    assert p.wait() == 0
+    shutil.rmtree(CLIENT_TOP_DIRECTORY, ignore_errors=True)
 
     # also remove certificates we created for the servers
-    p = subprocess.run(
-        [
-            "sudo",
-            "-E",
-            "-u",
-            os.getenv("USER"),
-            "env",
-            "PATH=" + os.getenv("PATH"),
-            "rm",
-            "-rf",
-            "/tmp/certs",
-        ]
-    )
-    assert p.returncode == 0
+    shutil.rmtree("/tmp/certs", ignore_errors=True)
 
 
 def test_000_create_monitor():
@@ -84,8 +61,7 @@ def test_003_init_secondary():
     node2.create()
     node2.run()
 
-    assert node2.wait_until_state(target_state="secondary")
-    assert node1.wait_until_state(target_state="primary")
+    assert cluster.wait_until_states({node2: "secondary", node1: "primary"})
 
     node2.check_ssl("off", "prefer")
 
@@ -130,8 +106,7 @@ def test_008_disable_maintenance():
     print("Disabling maintenance on node2")
     node2.disable_maintenance()
     assert node2.wait_until_pg_is_running()
-    assert node2.wait_until_state(target_state="secondary")
-    assert node1.wait_until_state(target_state="primary")
+    assert cluster.wait_until_states({node2: "secondary", node1: "primary"})
 
 
 # upgrade to verify full
@@ -144,99 +119,61 @@ def test_009_enable_maintenance():
 
 
 def test_010_enable_ssl_verify_ca_monitor():
-    client_top_directory = os.path.join(os.getenv("HOME"), ".postgresql")
-
     print()
     print("Creating cluster root certificate")
     cluster.create_root_cert(
-        client_top_directory, basename="root", CN="/CN=root.pgautofailover.ca"
+        CLIENT_TOP_DIRECTORY, basename="root", CN="/CN=root.pgautofailover.ca"
     )
 
-    p = subprocess.run(
-        [
-            "ls",
-            "-ld",
-            client_top_directory,
-            cluster.cert.crt,
-            cluster.cert.csr,
-            cluster.cert.key,
-        ],
-        text=True,
-        capture_output=True,
+    pgautofailover.print_file_modes(
+        CLIENT_TOP_DIRECTORY,
+        cluster.cert.crt,
+        cluster.cert.key,
     )
-    print("%s" % p.stdout)
 
-    # now create and sign the CLIENT certificate
-    print("Creating cluster client certificate")
+    # now create and sign the CLIENT certificate, and the SERVER certificate
+    # for the monitor
+    print("Creating cluster client and monitor server certificates")
     clientCert = cert.SSLCert(
-        client_top_directory, basename="postgresql", CN="/CN=autoctl_node"
+        CLIENT_TOP_DIRECTORY, basename="postgresql", CN="/CN=autoctl_node"
     )
-    clientCert.create_signed_certificate(cluster.cert)
-
-    p = subprocess.run(
-        [
-            "ls",
-            "-ld",
-            client_top_directory,
-            clientCert.crt,
-            clientCert.csr,
-            clientCert.key,
-        ],
-        text=True,
-        capture_output=True,
+    monitorCert = cert.SSLCert(
+        "/tmp/certs/monitor", "server", "/CN=monitor.pgautofailover.ca"
     )
-    print("%s" % p.stdout)
+    cert.create_signed_certificates([clientCert, monitorCert], cluster.cert)
 
-    # the root user also needs the certificates, tests are connecting with it
-    root_top_directory = "/root/.postgresql"
-    p = subprocess.run(
-        ["sudo", "install", "-d", "-m", "740", root_top_directory]
+    pgautofailover.print_file_modes(
+        CLIENT_TOP_DIRECTORY,
+        clientCert.crt,
+        clientCert.csr,
+        clientCert.key,
     )
-    assert p.returncode == 0
-
-    p = subprocess.run(
-        [
-            "sudo",
-            "cp",
-            clientCert.crt,
-            clientCert.csr,
-            clientCert.key,
-            root_top_directory,
-        ]
-    )
-    assert p.returncode == 0
 
-    p = subprocess.run(
-        ["ls", "-l", "/root/.postgresql"], text=True, capture_output=True
-    )
-    print("%s" % p.stdout)
+    # the root user also needs the certificates, tests are connecting with it
+    os.makedirs(ROOT_TOP_DIRECTORY, exist_ok=True)
+    os.chmod(ROOT_TOP_DIRECTORY, 0o740)
 
-    # now create and sign the SERVER certificate for the monitor
-    print("Creating monitor server certificate")
-    monitorCert = cert.SSLCert(
-        "/tmp/certs/monitor", "server", "/CN=monitor.pgautofailover.ca"
+    for path in [clientCert.crt, clientCert.csr, clientCert.key]:
+        shutil.copy(path, ROOT_TOP_DIRECTORY)
+
+    pgautofailover.print_file_modes(
+        *[
+            os.path.join(ROOT_TOP_DIRECTORY, f)
+            for f in sorted(os.listdir(ROOT_TOP_DIRECTORY))
+        ]
     )
-    monitorCert.create_signed_certificate(cluster.cert)
-
-    p = subprocess.run(
-        [
-            "ls",
-            "-ld",
-            client_top_directory,
-            cluster.cert.crt,
-            cluster.cert.csr,
-            cluster.cert.key,
-            clientCert.crt,
-            clientCert.csr,
-            clientCert.key,
-            monitorCert.crt,
-            monitorCert.csr,
-            monitorCert.key,
-        ],
-        text=True,
-        capture_output=True,
+
+    pgautofailover.print_file_modes(
+        CLIENT_TOP_DIRECTORY,
+        cluster.cert.crt,
+        cluster.cert.key,
+        clientCert.crt,
+        clientCert.csr,
+        clientCert.key,
+        monitorCert.crt,
+        monitorCert.csr,
+        monitorCert.key,
     )
-    print("%s" % p.stdout)
 
     monitor.enable_ssl(
         sslCAFile=cluster.cert.crt,
@@ -290,8 +227,7 @@ def test_013_disable_maintenance():
     print("Disabling maintenance on node2")
     node2.disable_maintenance()
     assert node2.wait_until_pg_is_running()
-    assert node2.wait_until_state(target_state="secondary")
-    assert node1.wait_until_state(target_state="primary")
+    assert cluster.wait_until_states({node2: "secondary", node1: "primary"})
 
 
 def test_014_enable_ssl_require_primary():
@@ -46,34 +46,27 @@ def test_002_make_installcheck():
     else:
         topdir = "/usr/src/pg_auto_failover"
 
-    p = subprocess.Popen(
-        [
-            "sudo",
-            shutil.which("chmod"),
-            "-R",
-            "go+w",
-            os.path.join(topdir, "src/monitor"),
-        ]
+    # the sources belong to root, the regression outputs to the test user
+    pgautofailover.run_as_user(
+        shutil.which("chmod"),
+        "-R",
+        "go+w",
+        os.path.join(topdir, "src/monitor"),
+        user="root",
     )
-    assert p.wait() == 0
-
-    p = subprocess.Popen(
-        [
-            "sudo",
-            "-E",
-            "-u",
-            os.getenv("USER"),
-            "env",
-            "PATH=" + os.getenv("PATH"),
+
+    p = subprocess.run(
+        pgautofailover.SUDO_AS_USER
+        + [
             "PGHOST=" + str(cluster.monitor.vnode.address),
             "make",
             "-C",
             os.path.join(topdir, "src/monitor"),
             "installcheck",
-        ]
+        ],
     )
 
-    if p.wait() != 0:
+    if p.returncode != 0:
         diff = os.path.join(topdir, "src/monitor/regression.diffs")
         with open(diff, "r") as d:
             print("%s" % d.read())
@@ -1,7 +1,6 @@
 import tests.pgautofailover_utils as pgautofailover
 from nose.tools import raises, eq_
 import time
-import subprocess
 
 import os.path
 
@@ -26,20 +25,7 @@ def test_000_create_monitor():
     global monitor
 
     # test creating the monitor in an existing empty directory
-    p = subprocess.Popen(
-        [
-            "sudo",
-            "-E",
-            "-u",
-            os.getenv("USER"),
-            "env",
-            "PATH=" + os.getenv("PATH"),
-            "mkdir",
-            "-p",
-            "/tmp/multi_async/monitor",
-        ]
-    )
-    assert p.wait() == 0
+    pgautofailover.sudo_mkdir_p("/tmp/multi_async/monitor")
 
     monitor = cluster.create_monitor("/tmp/multi_async/monitor")
     monitor.run()
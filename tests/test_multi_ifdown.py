@@ -1,6 +1,5 @@
 import tests.pgautofailover_utils as pgautofailover
 from nose.tools import raises, eq_
-import time
 
 import os.path
 
@@ -120,16 +119,12 @@ def test_007_insert_rows():
     node1.run_sql_query("CHECKPOINT")
 
     lsn1 = node1.run_sql_query("select pg_current_wal_lsn()")[0][0]
-    print("%s " % lsn1, end="", flush=True)
 
     # node2 is sync and should get the WAL
-    lsn2 = node2.run_sql_query("select pg_last_wal_receive_lsn()")[0][0]
-    print("%s " % lsn2, end="", flush=True)
+    node2.wait_until_wal_received(lsn1)
 
-    while lsn2 != lsn1:
-        time.sleep(1)
-        lsn2 = node2.run_sql_query("select pg_last_wal_receive_lsn()")[0][0]
-        print("%s " % lsn2, end="", flush=True)
+    lsn2 = node2.run_sql_query("select pg_last_wal_receive_lsn()")[0][0]
+    print("%s %s" % (lsn1, lsn2))
 
     eq_(lsn1, lsn2)
 
@@ -224,21 +219,17 @@ def test_013_secondary_gets_behind_primary():
     assert results == [(10006,)]
 
     lsn1 = node1.run_sql_query("select pg_last_wal_receive_lsn()")[0][0]
-    print("%s " % lsn1, end="", flush=True)
 
     # ensure the monitor received this lsn
-    node1.pg_autoctl.sighup()  # wake up from the 10s node_active delay
-    time.sleep(1)
-
-    q = "select reportedlsn from pgautofailover.node where nodeid = 1"
-    lsn1m = monitor.run_sql_query(q)[0][0]
-    print("%s " % lsn1m, end="", flush=True)
-
-    retry = 0
-    while lsn1 != lsn1m and retry < 3:
-        time.sleep(1)
-        lsn1m = monitor.run_sql_query(q)[0][0]
-        print("%s " % lsn1m, end="", flush=True)
+    node1.pg_autoctl.sighup()  # wake up from the node_active delay
+    q = "select reportedlsn from pgautofailover.node where nodeid = %s"
+
+    assert cluster.wait_until(
+        lambda: monitor.run_sql_query(q, node1.nodeid)[0][0] == lsn1
+    ), ("the monitor did not receive LSN %s from node1" % lsn1)
+    lsn1m = monitor.run_sql_query(q, node1.nodeid)[0][0]
+
+    print("%s %s" % (lsn1, lsn1m))
 
     eq_(lsn1, lsn1m)
 
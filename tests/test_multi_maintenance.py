@@ -1,6 +1,5 @@
 import tests.pgautofailover_utils as pgautofailover
 from nose.tools import raises, eq_
-import time
 
 import os.path
 
@@ -46,8 +45,7 @@ def test_002_add_standby():
     assert node2.wait_until_state(target_state="secondary")
     assert node1.wait_until_state(target_state="primary")
 
-    assert node1.has_needed_replication_slots()
-    assert node2.has_needed_replication_slots()
+    assert cluster.all_have_needed_replication_slots([node1, node2])
 
     # make sure we reached primary on node1 before next tests
     assert node1.wait_until_state(target_state="primary")
@@ -68,9 +66,7 @@ def test_003_add_standby():
     assert node2.wait_until_state(target_state="secondary")
     assert node1.wait_until_state(target_state="primary")
 
-    assert node1.has_needed_replication_slots()
-    assert node2.has_needed_replication_slots()
-    assert node3.has_needed_replication_slots()
+    assert cluster.all_have_needed_replication_slots([node1, node2, node3])
 
     # the formation number_sync_standbys is expected to be set to 1 now
     eq_(node1.get_number_sync_standbys(), 1)
@@ -85,7 +81,6 @@ def test_003_add_standby():
 def test_004_write_into_primary():
     node1.run_sql_query("CREATE TABLE t1(a int)")
     node1.run_sql_query("INSERT INTO t1 VALUES (1), (2), (3), (4)")
-    node1.run_sql_query("CHECKPOINT")
 
     results = node1.run_sql_query("SELECT * FROM t1")
     assert results == [(1,), (2,), (3,), (4,)]
@@ -96,9 +91,13 @@ def test_005_set_candidate_priorities():
     assert node1.wait_until_state(target_state="primary")
 
     # set priorities in a way that we know the candidate: node3
-    node1.set_candidate_priority(80)  # current primary
-    node2.set_candidate_priority(70)  # remain secondary
-    node3.set_candidate_priority(90)  # favorite for failover
+    cluster.set_candidate_priorities(
+        {
+            node1: 80,  # current primary
+            node2: 70,  # remain secondary
+            node3: 90,  # favorite for failover
+        }
+    )
 
     # when we set candidate priority we go to apply_settings then primary
     print()
@@ -107,10 +106,10 @@ def test_005_set_candidate_priorities():
     assert node3.wait_until_state(target_state="secondary")
 
     # node2 should still be "sync"
-    eq_(node2.get_replication_quorum(), True)
+    eq_(node2.get_node_settings().replication_quorum, True)
 
     # other replication settings should still be the same as before
-    eq_(node1.get_number_sync_standbys(), 1)
+    eq_(node1.get_node_settings().number_sync_standbys, 1)
 
     ssn = "ANY 1 (pgautofailover_standby_3, pgautofailover_standby_2)"
     node1.check_synchronous_standby_names(ssn)
@@ -119,8 +118,7 @@ def test_005_set_candidate_priorities():
 def test_006a_maintenance_and_failover():
     print()
     print("Enabling maintenance on node2")
-    node2.enable_maintenance()
-    assert node2.wait_until_state(target_state="maintenance")
+    assert node2.enable_maintenance_and_wait()
     node2.stop_postgres()
 
     # assigned and goal state must be the same
@@ -153,7 +151,8 @@ def test_006a_maintenance_and_failover():
         fn = "postgresql-auto-failover-standby.conf"
 
     fn = os.path.join(node2.datadir, fn)
-    conf = open(fn).read()
+    with open(fn, "r") as f:
+        conf = f.read()
 
     if primary_conninfo_ipaddr not in conf:
         raise Exception(
@@ -168,9 +167,7 @@ def test_006a_maintenance_and_failover():
     # ssn is not changed during maintenance operations
     node3.check_synchronous_standby_names(ssn)
 
-    assert node1.has_needed_replication_slots()
-    assert node2.has_needed_replication_slots()
-    assert node3.has_needed_replication_slots()
+    assert cluster.all_have_needed_replication_slots([node1, node2, node3])
 
 
 def test_006b_read_from_new_primary():
@@ -260,7 +257,6 @@ def test_011_all_to_maintenance():
 
 def test_012_can_write_during_maintenance():
     node3.run_sql_query("INSERT INTO t1 VALUES (5), (6)")
-    node3.run_sql_query("CHECKPOINT")
 
 
 def test_013_add_standby():
@@ -275,8 +271,7 @@ def test_013_add_standby():
     assert node2.wait_until_state(target_state="maintenance")
     assert node1.wait_until_state(target_state="maintenance")
 
-    assert node3.has_needed_replication_slots()
-    assert node4.has_needed_replication_slots()
+    assert cluster.all_have_needed_replication_slots([node3, node4])
 
     # the formation number_sync_standbys is expected to not be changed
     eq_(node3.get_number_sync_standbys(), 0)
@@ -360,17 +355,25 @@ def test_018_disable_maintenance():
 
 def test_019_set_priorities():
     # set priorities in a way that we know the candidate: node1
-    node1.set_candidate_priority(90)
-    node2.set_candidate_priority(70)
-    node3.set_candidate_priority(70)  # current primary
-    node4.set_candidate_priority(70)
+    cluster.set_candidate_priorities(
+        {
+            node1: 90,
+            node2: 70,
+            node3: 70,  # current primary
+            node4: 70,
+        }
+    )
 
     # when we set candidate priority we go to apply_settings then primary
     print()
-    assert node1.wait_until_state(target_state="secondary")
-    assert node2.wait_until_state(target_state="secondary")
-    assert node3.wait_until_state(target_state="primary")
-    assert node4.wait_until_state(target_state="secondary")
+    assert cluster.wait_until_states(
+        {
+            node1: "secondary",
+            node2: "secondary",
+            node3: "primary",
+            node4: "secondary",
+        }
+    )
 
 
 def test_020_primary_to_maintenance():
@@ -378,9 +381,8 @@ def test_020_primary_to_maintenance():
     assert node3.wait_until_state(target_state="primary")
 
     print("Enabling maintenance on node3, allowing failover")
-    node3.enable_maintenance(allowFailover=True)
+    assert node3.enable_maintenance_and_wait(allowFailover=True)
 
-    assert node3.wait_until_state(target_state="maintenance")
     assert node2.wait_until_state(target_state="secondary")
     assert node4.wait_until_state(target_state="secondary")
     assert node1.wait_until_state(target_state="primary")
@@ -389,12 +391,13 @@ def test_020_primary_to_maintenance():
 def test_021_stop_maintenance():
     print()
     print("Disabling maintenance on node3")
-    node3.disable_maintenance()
-
+    assert node3.disable_maintenance_and_wait(target_state="secondary")
     assert node3.wait_until_pg_is_running()
-    assert node3.wait_until_state(target_state="secondary")
 
-    assert node1.wait_until_state(target_state="primary")
-
-    assert node2.wait_until_state(target_state="secondary")
-    assert node4.wait_until_state(target_state="secondary")
+    assert cluster.wait_until_states(
+        {
+            node1: "primary",
+            node2: "secondary",
+            node4: "secondary",
+        }
+    )
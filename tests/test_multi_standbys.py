@@ -1,8 +1,5 @@
 import tests.pgautofailover_utils as pgautofailover
-from nose.tools import raises, eq_
-import time
-
-import os.path
+from nose.tools import eq_
 
 cluster = None
 monitor = None
@@ -32,10 +29,9 @@ def test_000_create_monitor():
 
 def test_001_init_primary():
     global node1
-    node1 = cluster.create_datanode("/tmp/multi_standby/node1")
-    node1.create()
-    node1.run()
-    assert node1.wait_until_state(target_state="single")
+    node1 = cluster.launch_datanode(
+        "/tmp/multi_standby/node1", target_state="single"
+    )
 
 
 def test_002_candidate_priority():
@@ -66,16 +62,13 @@ def test_004_001_add_three_standbys():
     # so we need at least 3 standbys to allow that
     global node2
 
-    node2 = cluster.create_datanode("/tmp/multi_standby/node2")
-    node2.create()
-    node2.run()
-
-    assert node2.wait_until_state(target_state="secondary")
+    node2 = cluster.launch_datanode(
+        "/tmp/multi_standby/node2", target_state="secondary"
+    )
 
     assert node2.wait_until_pg_is_running()
 
-    assert node1.has_needed_replication_slots()
-    assert node2.has_needed_replication_slots()
+    assert cluster.all_have_needed_replication_slots([node1, node2])
 
     # with one standby, we have number_sync_standbys set to 0 still
     assert node1.get_number_sync_standbys() == 0
@@ -98,9 +91,7 @@ def test_004_002_add_three_standbys():
 
     assert node3.wait_until_pg_is_running()
 
-    assert node1.has_needed_replication_slots()
-    assert node2.has_needed_replication_slots()
-    assert node3.has_needed_replication_slots()
+    assert cluster.all_have_needed_replication_slots([node1, node2, node3])
 
     # the formation number_sync_standbys is expected to be set to 1 now
     assert node1.get_number_sync_standbys() == 1
@@ -120,10 +111,9 @@ def test_004_003_add_three_standbys():
 
     assert node4.wait_until_pg_is_running()
 
-    assert node1.has_needed_replication_slots()
-    assert node2.has_needed_replication_slots()
-    assert node3.has_needed_replication_slots()
-    assert node4.has_needed_replication_slots()
+    assert cluster.all_have_needed_replication_slots(
+        [node1, node2, node3, node4]
+    )
 
 
 def test_005_number_sync_standbys():
@@ -137,14 +127,14 @@ def test_005_number_sync_standbys():
     assert node1.set_number_sync_standbys(2)
     assert node1.get_number_sync_standbys() == 2
 
-    ssn = "ANY 2 (pgautofailover_standby_2, pgautofailover_standby_3, pgautofailover_standby_4)"
+    ssn = pgautofailover.ssn_for(2, [2, 3, 4])
     node1.check_synchronous_standby_names(ssn)
 
     print("set number_sync_standbys = 0")
     assert node1.set_number_sync_standbys(0)
     assert node1.get_number_sync_standbys() == 0
 
-    ssn = "ANY 1 (pgautofailover_standby_2, pgautofailover_standby_3, pgautofailover_standby_4)"
+    ssn = pgautofailover.ssn_for(1, [2, 3, 4])
     node1.check_synchronous_standby_names(ssn)
 
     print("set number_sync_standbys = 1")
@@ -164,34 +154,34 @@ def test_006_number_sync_standbys_trigger():
 
     assert node1.wait_until_state(target_state="primary")
 
-    ssn = "ANY 1 (pgautofailover_standby_2, pgautofailover_standby_3)"
+    ssn = pgautofailover.ssn_for(1, [node2.nodeid, node3.nodeid])
     node1.check_synchronous_standby_names(ssn)
 
     # there's no state change to instruct us that the replication slot
-    # maintenance is now done, so we have to wait for awhile instead.
+    # maintenance is now done, so we poll for the expected slots instead.
 
     node1.pg_autoctl.sighup()  # wake up from the 10s node_active delay
     node2.pg_autoctl.sighup()  # wake up from the 10s node_active delay
     node3.pg_autoctl.sighup()  # wake up from the 10s node_active delay
 
-    time.sleep(6)
-
-    assert node1.has_needed_replication_slots()
-    assert node2.has_needed_replication_slots()
-    assert node3.has_needed_replication_slots()
+    cluster.wait_until(
+        lambda: cluster.all_have_needed_replication_slots(
+            [node1, node2, node3], verbose=False
+        )
+    )
+    assert cluster.all_have_needed_replication_slots([node1, node2, node3])
 
 
 def test_007_create_t1():
     node1.run_sql_query("CREATE TABLE t1(a int)")
     node1.run_sql_query("INSERT INTO t1 VALUES (1), (2)")
-    node1.run_sql_query("CHECKPOINT")
 
 
 def test_008_set_candidate_priorities():
     # set priorities in a way that we know the candidate: node2
-    node1.set_candidate_priority(90)  # current primary
-    node2.set_candidate_priority(90)
-    node3.set_candidate_priority(70)
+    cluster.set_candidate_priorities(
+        {node1: 90, node2: 90, node3: 70}  # node1 is the current primary
+    )
 
     print()
     assert node1.wait_until_state(target_state="primary")
@@ -201,16 +191,14 @@ def test_009_failover():
     print()
     print("Calling pgautofailover.failover() on the monitor")
     monitor.failover()
-    assert node2.wait_until_state(target_state="primary")
-    assert node3.wait_until_state(target_state="secondary")
-    assert node1.wait_until_state(target_state="secondary")
+    assert cluster.wait_until_states(
+        {node2: "primary", node3: "secondary", node1: "secondary"}
+    )
 
-    ssn = "ANY 1 (pgautofailover_standby_1, pgautofailover_standby_3)"
+    ssn = pgautofailover.ssn_for(1, [node1.nodeid, node3.nodeid])
     node2.check_synchronous_standby_names(ssn)
 
-    assert node1.has_needed_replication_slots()
-    assert node2.has_needed_replication_slots()
-    assert node3.has_needed_replication_slots()
+    assert cluster.all_have_needed_replication_slots([node1, node2, node3])
 
 
 def test_010_read_from_nodes():
@@ -224,9 +212,6 @@ def test_011_write_into_new_primary():
     results = node2.run_sql_query("SELECT * FROM t1")
     assert results == [(1,), (2,), (3,), (4,)]
 
-    # generate more WAL traffic for replication
-    node2.run_sql_query("CHECKPOINT")
-
 
 def test_012_fail_primary():
     print()
@@ -238,7 +223,7 @@ def test_012_fail_primary():
     assert node1.wait_until_state(target_state="primary")
     assert node3.wait_until_state(target_state="secondary")
 
-    ssn = "ANY 1 (pgautofailover_standby_2, pgautofailover_standby_3)"
+    ssn = pgautofailover.ssn_for(1, [node2.nodeid, node3.nodeid])
     node1.check_synchronous_standby_names(ssn)
 
 
@@ -249,7 +234,7 @@ def test_013_restart_node2():
     assert node2.wait_until_state(target_state="secondary")
     assert node3.wait_until_state(target_state="secondary")
 
-    ssn = "ANY 1 (pgautofailover_standby_2, pgautofailover_standby_3)"
+    ssn = pgautofailover.ssn_for(1, [node2.nodeid, node3.nodeid])
     node1.check_synchronous_standby_names(ssn)
 
 
@@ -261,15 +246,13 @@ def test_013_restart_node2():
 def test_014_001_fail_set_properties():
     eq_(node1.get_number_sync_standbys(), 1)
 
-    node1.set_candidate_priority(50)
-    node2.set_candidate_priority(50)
-    node3.set_candidate_priority(50)
+    cluster.set_candidate_priorities({node1: 50, node2: 50, node3: 50})
 
     node1.wait_until_state(target_state="primary")
 
-    assert node1.get_replication_quorum()
-    assert node2.get_replication_quorum()
-    assert node3.get_replication_quorum()
+    assert node1.get_node_settings().replication_quorum
+    assert node2.get_node_settings().replication_quorum
+    assert node3.get_node_settings().replication_quorum
 
 
 def test_014_002_fail_two_standby_nodes():
@@ -282,7 +265,7 @@ def test_014_002_fail_two_standby_nodes():
     # node1 remains a primary, blocking writes, at this stage
     node1.wait_until_state(target_state="primary")
 
-    ssn = "ANY 1 (pgautofailover_standby_2, pgautofailover_standby_3)"
+    ssn = pgautofailover.ssn_for(1, [node2.nodeid, node3.nodeid])
     node1.check_synchronous_standby_names(ssn)
 
 
@@ -304,7 +287,7 @@ def test_014_004_restart_nodes():
     assert node2.wait_until_state(target_state="secondary")
     assert node1.wait_until_state(target_state="primary")
 
-    ssn = "ANY 1 (pgautofailover_standby_2, pgautofailover_standby_3)"
+    ssn = pgautofailover.ssn_for(1, [node2.nodeid, node3.nodeid])
     node1.check_synchronous_standby_names(ssn)
 
 
@@ -346,7 +329,7 @@ def test_015_003_set_properties():
 
     eq_(node1.get_number_sync_standbys(), 1)
 
-    ssn = "ANY 1 (pgautofailover_standby_2, pgautofailover_standby_3)"
+    ssn = pgautofailover.ssn_for(1, [node2.nodeid, node3.nodeid])
     node1.check_synchronous_standby_names(ssn)
 
 
@@ -358,7 +341,7 @@ def test_015_004_restart_nodes():
     assert node2.wait_until_state(target_state="secondary")
     assert node1.wait_until_state(target_state="primary")
 
-    ssn = "ANY 1 (pgautofailover_standby_2, pgautofailover_standby_3)"
+    ssn = pgautofailover.ssn_for(1, [node2.nodeid, node3.nodeid])
     node1.check_synchronous_standby_names(ssn)
 
 
@@ -366,9 +349,7 @@ def test_015_004_restart_nodes():
 # Now test a failover when all the nodes have candidate priority set to zero
 #
 def test_016_001_set_candidate_priorities_to_zero():
-    node1.set_candidate_priority(0)
-    node2.set_candidate_priority(0)
-    node3.set_candidate_priority(0)
+    cluster.set_candidate_priorities({node1: 0, node2: 0, node3: 0})
 
     # no candidate for failover, we're wait_primary
     node1.wait_until_state(target_state="primary")
@@ -379,9 +360,9 @@ def test_016_002_trigger_failover():
     print("Calling pgautofailover.failover() on the monitor")
     monitor.failover()
 
-    assert node3.wait_until_state(target_state="report_lsn")
-    assert node2.wait_until_state(target_state="report_lsn")
-    assert node1.wait_until_state(target_state="report_lsn")
+    assert cluster.wait_until_states(
+        {node3: "report_lsn", node2: "report_lsn", node1: "report_lsn"}
+    )
 
 
 def test_016_003_set_candidate_priority_to_one():
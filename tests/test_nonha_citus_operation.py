@@ -1,5 +1,7 @@
 import tests.pgautofailover_utils as pgautofailover
-from nose.tools import *
+from nose.tools import raises
+
+from concurrent.futures import ThreadPoolExecutor
 
 cluster = None
 monitor = None
@@ -38,16 +40,13 @@ def test_001_create_formation():
 def test_002_init_coordinator():
     global coordinator1a
 
-    coordinator1a = cluster.create_datanode(
+    print()  # make the debug output more readable
+    coordinator1a = cluster.launch_datanode(
         "/tmp/citus/nonha/coordinator1a",
+        target_state="single",
         role=pgautofailover.Role.Coordinator,
         formation="non-ha",
     )
-    coordinator1a.create()
-    coordinator1a.run()
-
-    print()  # make the debug output more readable
-    assert coordinator1a.wait_until_state(target_state="single")
 
     # we need to expose some Citus testing internals
     assert coordinator1a.wait_until_pg_is_running()
@@ -64,8 +63,7 @@ def test_003_init_workers():
         group=1,
         formation="non-ha",
     )
-    worker1a.create()
-    worker1a.run()
+    worker1a.create_and_run()
 
     worker2a = cluster.create_datanode(
         "/tmp/citus/nonha/worker2a",
@@ -73,8 +71,7 @@ def test_003_init_workers():
         group=2,
         formation="non-ha",
     )
-    worker2a.create()
-    worker2a.run()
+    worker2a.create_and_run()
 
     # wait here till all workers are stable and in the desired state
     # by not waiting on all workers separately this should save a bit of time
@@ -105,32 +102,34 @@ def test_006_add_secondaries():
         role=pgautofailover.Role.Coordinator,
         formation="non-ha",
     )
-    coordinator1b.create()
-    coordinator1b.run()
-
     worker1b = cluster.create_datanode(
         "/tmp/citus/nonha/worker1b",
         role=pgautofailover.Role.Worker,
         group=1,
         formation="non-ha",
     )
-    worker1b.create()
-    worker1b.run()
-
     worker2b = cluster.create_datanode(
         "/tmp/citus/nonha/worker2b",
         role=pgautofailover.Role.Worker,
         group=2,
         formation="non-ha",
     )
-    worker2b.create()
-    worker2b.run()
-    # wait here till all workers are stable and in the desired state
-    # by not waiting on all workers separately this should save a bit of time
+
+    # each secondary joins a different group, so they are created
+    # concurrently and their base backups overlap
+    secondaries = (coordinator1b, worker1b, worker2b)
+
+    with ThreadPoolExecutor(max_workers=len(secondaries)) as executor:
+        for future in [
+            executor.submit(node.create_and_run) for node in secondaries
+        ]:
+            future.result()
+
+    # wait here till all secondaries are stable and in the desired state
     print()  # make the debug output more readable
-    assert coordinator1b.wait_until_state(target_state="secondary")
-    assert worker1b.wait_until_state(target_state="secondary")
-    assert worker2b.wait_until_state(target_state="secondary")
+    assert cluster.wait_until_states(
+        {node: "secondary" for node in secondaries}
+    )
 
 
 @raises(Exception)
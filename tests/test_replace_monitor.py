@@ -1,5 +1,4 @@
 import tests.pgautofailover_utils as pgautofailover
-import time
 
 from nose.tools import eq_
 
@@ -1,8 +1,7 @@
 import tests.pgautofailover_utils as pgautofailover
 from nose.tools import eq_
 
-import subprocess
-import os, os.path, time, shutil
+import os, os.path, difflib
 
 cluster = None
 node1 = None
@@ -35,11 +34,12 @@ def test_001_init_primary():
     print()
     node1_path = cluster.pg_createcluster("node1")
 
-    # make a copy of the debian's HBA file
+    # keep the contents of the debian's HBA file
     hba_path = os.path.join(
         "/etc", "/".join(node1_path.split("/")[3:]), "pg_hba.conf"
     )
-    shutil.copyfile(hba_path, "/tmp/pg_hba.debian.conf")
+    with open(hba_path) as hba:
+        debian_hba_lines = hba.readlines()
 
     # allow using unix domain sockets
     pgautofailover.sudo_mkdir_p("/tmp/socks/node1")
@@ -54,22 +54,21 @@ def test_001_init_primary():
     # Check that we didn't edit the HBA file, thanks to --skip-pg-hba, here
     # in the test file spelled the strange way --auth skip.
     #
-    p = subprocess.run(
-        [
-            "diff",
-            "/tmp/pg_hba.debian.conf",
-            os.path.join(node1_path, "pg_hba.conf"),
-        ],
-        text=True,
-        capture_output=True,
-    )
+    node1_hba_path = os.path.join(node1_path, "pg_hba.conf")
 
-    print("diff %s" % " ".join(p.args))
+    with open(node1_hba_path) as hba:
+        node1_hba_lines = hba.readlines()
 
-    if p.returncode != 0:
-        print("%s" % p.stdout)
+    if node1_hba_lines != debian_hba_lines:
+        print(
+            "".join(
+                difflib.unified_diff(
+                    debian_hba_lines, node1_hba_lines, hba_path, node1_hba_path
+                )
+            )
+        )
 
-    assert p.returncode == 0
+    assert node1_hba_lines == debian_hba_lines
 
     with open(os.path.join(node1_path, "pg_hba.conf"), "a") as hba:
         # node1.run_sql_query will need
@@ -107,8 +106,7 @@ def test_003_init_secondary():
     node2.reload_postgres()
 
     node2.run()
-    assert node2.wait_until_state(target_state="secondary")
-    assert node1.wait_until_state(target_state="primary")
+    assert cluster.wait_until_states({node2: "secondary", node1: "primary"})
 
 
 def test_004a_hba_have_not_been_edited():
@@ -125,8 +123,7 @@ def test_005_failover():
     print()
     print("Calling pgautofailover.failover() on the monitor")
     cluster.monitor.failover()
-    assert node2.wait_until_state(target_state="primary")
-    assert node1.wait_until_state(target_state="secondary")
+    assert cluster.wait_until_states({node2: "primary", node1: "secondary"})
 
 
 def test_006_restart_secondary():
@@ -1,23 +1,26 @@
 import tests.pgautofailover_utils as pgautofailover
 import tests.ssl_cert_utils as cert
-from nose.tools import *
+import os, os.path, shutil
 
-import subprocess
-import os, os.path, time, shutil
+# libpq reads the client certificates from ~/.postgresql, and the tests
+# connect as root too
+CLIENT_TOP_DIRECTORY = os.path.join(os.getenv("HOME"), ".postgresql")
+ROOT_TOP_DIRECTORY = "/root/.postgresql"
 
 cluster = None
 node1 = None
 node2 = None
 
+# server certificates of the data nodes, by node name
+nodeCerts = {}
+
 
 def setup_module():
     global cluster
     cluster = pgautofailover.Cluster()
 
-    client_top_directory = os.path.join(os.getenv("HOME"), ".postgresql")
-
     cluster.create_root_cert(
-        client_top_directory, basename="root", CN="/CN=root.pgautofailover.ca"
+        CLIENT_TOP_DIRECTORY, basename="root", CN="/CN=root.pgautofailover.ca"
     )
 
 
@@ -25,38 +28,10 @@ def teardown_module():
     cluster.destroy()
 
     # remove client side setup for certificates too
-    client_top_directory = os.path.join(os.getenv("HOME"), ".postgresql")
-
-    p = subprocess.Popen(
-        [
-            "sudo",
-            "-E",
-            "-u",
-            os.getenv("USER"),
-            "env",
-            "PATH=" + os.getenv("PATH"),
-            "rm",
-            "-rf",
-            client_top_directory,
-        ]
-    )
-    assert p.wait() == 0
+    shutil.rmtree(CLIENT_TOP_DIRECTORY, ignore_errors=True)
 
     # also remove certificates we created for the servers
-    p = subprocess.run(
-        [
-            "sudo",
-            "-E",
-            "-u",
-            os.getenv("USER"),
-            "env",
-            "PATH=" + os.getenv("PATH"),
-            "rm",
-            "-rf",
-            "/tmp/certs",
-        ]
-    )
-    assert p.returncode == 0
+    shutil.rmtree("/tmp/certs", ignore_errors=True)
 
 
 def test_000_create_monitor():
@@ -78,62 +53,47 @@ def test_000_create_monitor():
     # home directory
     # Now, create a server certificate signed by the new root certificate
     # authority
-    client_top_directory = os.path.join(os.getenv("HOME"), ".postgresql")
 
-    # now create and sign the CLIENT certificate
+    # now create and sign the CLIENT certificate, and the SERVER certificates
+    # for the monitor and the data nodes, all at once
     clientCert = cert.SSLCert(
-        client_top_directory, basename="postgresql", CN="/CN=autoctl_node"
+        CLIENT_TOP_DIRECTORY, basename="postgresql", CN="/CN=autoctl_node"
     )
-    clientCert.create_signed_certificate(cluster.cert)
-
-    # now create and sign the SERVER certificate for the monitor
     serverCert = cert.SSLCert(
         "/tmp/certs/monitor", "server", "/CN=monitor.pgautofailover.ca"
     )
-    serverCert.create_signed_certificate(cluster.cert)
 
-    # the root user also needs the certificates, tests are connecting with it
-    root_top_directory = "/root/.postgresql"
-    p = subprocess.run(
-        ["sudo", "install", "-d", "-m", "740", root_top_directory]
-    )
-    assert p.returncode == 0
-
-    p = subprocess.run(
-        [
-            "sudo",
-            "cp",
-            clientCert.crt,
-            clientCert.csr,
-            clientCert.key,
-            root_top_directory,
-        ]
+    for name in ["node1", "node2"]:
+        nodeCerts[name] = cert.SSLCert(
+            "/tmp/certs/%s" % name, "server", "/CN=%s.pgautofailover.ca" % name
+        )
+
+    cert.create_signed_certificates(
+        [clientCert, serverCert] + list(nodeCerts.values()), cluster.cert
     )
-    assert p.returncode == 0
-
-    p = subprocess.run(
-        [
-            "ls",
-            "-ld",
-            client_top_directory,
-            root_top_directory,
-            os.path.join(root_top_directory, "postgresql.crt"),
-            os.path.join(root_top_directory, "postgresql.csr"),
-            os.path.join(root_top_directory, "postgresql.key"),
-            cluster.cert.crt,
-            cluster.cert.csr,
-            cluster.cert.key,
-            clientCert.crt,
-            clientCert.csr,
-            clientCert.key,
-            serverCert.crt,
-            serverCert.csr,
-            serverCert.key,
-        ],
-        text=True,
-        capture_output=True,
+
+    # the root user also needs the certificates, tests are connecting with it
+    os.makedirs(ROOT_TOP_DIRECTORY, exist_ok=True)
+    os.chmod(ROOT_TOP_DIRECTORY, 0o740)
+
+    for path in [clientCert.crt, clientCert.csr, clientCert.key]:
+        shutil.copy(path, ROOT_TOP_DIRECTORY)
+
+    pgautofailover.print_file_modes(
+        CLIENT_TOP_DIRECTORY,
+        ROOT_TOP_DIRECTORY,
+        os.path.join(ROOT_TOP_DIRECTORY, "postgresql.crt"),
+        os.path.join(ROOT_TOP_DIRECTORY, "postgresql.csr"),
+        os.path.join(ROOT_TOP_DIRECTORY, "postgresql.key"),
+        cluster.cert.crt,
+        cluster.cert.key,
+        clientCert.crt,
+        clientCert.csr,
+        clientCert.key,
+        serverCert.crt,
+        serverCert.csr,
+        serverCert.key,
     )
-    print("%s" % p.stdout)
 
     #
     # Now create the monitor Postgres instance with the certificates
@@ -155,79 +115,59 @@ def test_000_create_monitor():
     monitor.reload_postgres()
 
     # check the SSL settings
-    cmd = [
-        "openssl",
-        "s_client",
-        "-starttls",
-        "postgres",
-        "-connect",
-        "172.27.1.2:5432",
-        "-showcerts",
-        "-CAfile",
-        cluster.cert.crt,
-    ]
-    print(" ".join(cmd))
-    p = subprocess.run(
-        [
-            "sudo",
-            "-E",
-            "-u",
-            os.getenv("USER"),
-            "env",
-            "PATH=" + os.getenv("PATH"),
-        ]
-        + cmd,
-        input="",
-        text=True,
-        capture_output=True,
-    )
-    if p.returncode != 0:
-        print("" % p.stdout)
-        print("" % p.stderr)
-    assert p.returncode == 0
+    print("monitor: %s" % monitor.tls_handshake(cluster.cert.crt)["subject"])
 
     # print connection string
     print("monitor: %s" % monitor.connection_string())
     monitor.check_ssl("on", "verify-ca")
 
 
-def test_001_init_primary():
-    global node1
-
-    # Create a server certificate signed by the root Certificate Authority
-    certs_dir = "/tmp/certs/node1"
-
-    serverCert = cert.SSLCert(
-        "/tmp/certs/node1", "server", "/CN=node1.pgautofailover.ca"
-    )
-    serverCert.create_signed_certificate(cluster.cert)
+def create_datanode_with_cert(name, hba_rules):
+    """
+    Creates the node named name with its server certificate signed by the
+    root Certificate Authority, and allows the given HBA rules for the
+    cluster network, using an ident map for replication.
+    """
+    serverCert = nodeCerts[name]
 
     # Now create the server with the certificates
-    node1 = cluster.create_datanode(
-        "/tmp/cert/node1",
+    datadir = "/tmp/cert/%s" % name
+    node = cluster.create_datanode(
+        datadir,
         authMethod="skip",
         sslMode="verify-ca",
         sslCAFile=cluster.cert.crt,
         sslServerKey=serverCert.key,
         sslServerCert=serverCert.crt,
     )
-    node1.create(level="-vv")
+    node.create(level="-vv")
+
+    with open(os.path.join(datadir, "pg_hba.conf"), "a") as hba:
+        for rule in hba_rules:
+            hba.write("%s %s cert\n" % (rule, cluster.networkSubnet))
 
-    with open(os.path.join("/tmp/cert/node1", "pg_hba.conf"), "a") as hba:
-        # node1.run_sql_query will need
-        # host "172.27.1.1", user "docker", database "postgres"
-        hba.write("hostssl postgres docker %s cert\n" % cluster.networkSubnet)
-        hba.write("hostssl all all %s cert\n" % cluster.networkSubnet)
         hba.write(
             "hostssl replication all %s cert map=pgautofailover\n"
             % cluster.networkSubnet
         )
 
-    with open(os.path.join("/tmp/cert/node1", "pg_ident.conf"), "a") as ident:
+    with open(os.path.join(datadir, "pg_ident.conf"), "a") as ident:
         # use an ident map to allow using the same cert for replication
         ident.write("pgautofailover autoctl_node pgautofailover_replicator\n")
 
-    node1.reload_postgres()
+    node.reload_postgres()
+
+    return node
+
+
+def test_001_init_primary():
+    global node1
+
+    # node1.run_sql_query will need
+    # host "172.27.1.1", user "docker", database "postgres"
+    node1 = create_datanode_with_cert(
+        "node1", ["hostssl postgres docker", "hostssl all all"]
+    )
 
     node1.run()
     assert node1.wait_until_state(target_state="single")
@@ -245,41 +185,10 @@ def test_002_create_t1():
 def test_003_init_secondary():
     global node2
 
-    # Create a server certificate signed by the root Certificate Authority
-    certs_dir = "/tmp/certs/node2"
-
-    serverCert = cert.SSLCert(
-        "/tmp/certs/node2", "server", "/CN=node2.pgautofailover.ca"
-    )
-    serverCert.create_signed_certificate(cluster.cert)
-
-    # Now create the server with the certificates
-    node2 = cluster.create_datanode(
-        "/tmp/cert/node2",
-        authMethod="skip",
-        sslMode="verify-ca",
-        sslCAFile=cluster.cert.crt,
-        sslServerKey=serverCert.key,
-        sslServerCert=serverCert.crt,
-    )
-    node2.create(level="-vv")
-
-    with open(os.path.join("/tmp/cert/node2", "pg_hba.conf"), "a") as hba:
-        hba.write("hostssl all all %s cert\n" % cluster.networkSubnet)
-        hba.write(
-            "hostssl replication all %s cert map=pgautofailover\n"
-            % cluster.networkSubnet
-        )
-
-    with open(os.path.join("/tmp/cert/node1", "pg_ident.conf"), "a") as ident:
-        # use an ident map to allow using the same cert for replication
-        ident.write("pgautofailover autoctl_node pgautofailover_replicator\n")
-
-    node2.reload_postgres()
+    node2 = create_datanode_with_cert("node2", ["hostssl all all"])
 
     node2.run()
-    assert node2.wait_until_state(target_state="secondary")
-    assert node1.wait_until_state(target_state="primary")
+    assert cluster.wait_until_states({node2: "secondary", node1: "primary"})
     node2.wait_until_pg_is_running()
     node2.check_ssl("on", "verify-ca")
 
@@ -288,5 +197,4 @@ def test_004_failover():
     print()
     print("Calling pgautofailover.failover() on the monitor")
     cluster.monitor.failover()
-    assert node2.wait_until_state(target_state="primary")
-    assert node1.wait_until_state(target_state="secondary")
+    assert cluster.wait_until_states({node2: "primary", node1: "secondary"})